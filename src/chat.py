@@ -1,10 +1,47 @@
 import argparse
+import asyncio
+import concurrent.futures
+import contextvars
+import copy
+import functools
+import hashlib
+import inspect
+import itertools
+import json
+import multiprocessing
 import os
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
 from abc import ABC, abstractmethod
-from typing import Optional, Dict, Any, Iterator, List
-
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Optional,
+    Dict,
+    Any,
+    Callable,
+    Collection,
+    Iterator,
+    List,
+    NamedTuple,
+    Tuple,
+    Union,
+    get_args,
+    get_origin,
+    get_type_hints,
+)
+
+import anthropic
+import httpx
+import openai
 from anthropic import Anthropic
 from google import genai
+from google.genai import types
 from google.genai.types import GenerateContentConfig
 from openai import OpenAI
 
@@ -22,9 +59,273 @@ DEFAULT_TEMPERATURE = 0.7
 
 REASONING_MODELS = {"o3", "o4-mini"}
 DEFAULT_REASONING_EFFORT = "high"
+DEFAULT_MAX_TOOL_ROUNDS = 8
+DEFAULT_STREAM_BUFFER = 256
+DEFAULT_MAX_RESUMES = 2
+CONTINUE_PROMPT = (
+    "Your previous reply was cut off. Continue exactly where it stopped, "
+    "without repeating anything or adding any preamble."
+)
+MAX_CACHE_POINTS = 3
+
+CHARS_PER_TOKEN = 4
+DEFAULT_CHUNK_TOKENS = 1500
+DEFAULT_MAP_WORKERS = 4
+# From coarsest to finest: markdown headings, paragraphs, lines, sentences, words.
+SPLIT_BOUNDARIES = [
+    re.compile(r"(?=^#{1,6}\s)", re.MULTILINE),
+    re.compile(r"(?<=\n\n)"),
+    re.compile(r"(?<=\n)"),
+    re.compile(r"(?<=[.!?])(?=\s)"),
+    re.compile(r"(?<= )"),
+]
+
+DEFAULT_JUDGE_CRITERIA = "Correctness, relevance, clarity and completeness."
+JUDGE_SYSTEM_PROMPT = """
+You are a strict evaluator of AI responses.
+Score how well a response fulfills the request against the given criteria.
+Reply with a single number from 0 to 10 and nothing else.
+"""
+
+DEFAULT_GATEWAY_HOST = "127.0.0.1"
+DEFAULT_GATEWAY_PORT = 8000
+DEFAULT_GATEWAY_CONCURRENCY = 64
+DEFAULT_STDIO_WORKERS = 16
+
+DEFAULT_KEY_COOLDOWN = 30.0
+KEY_FAILURE_LIMIT = 3
+DEFAULT_MAX_RETRIES = 2
+RETRY_BACKOFF = 0.5
+MAX_RETRY_BACKOFF = 8.0
+KEY_STRATEGIES = ("least_loaded", "round_robin")
+
+DEFAULT_EMBEDDING_MODEL = "embed-small"
+DEFAULT_EMBED_WORKERS = 4
+DEFAULT_TOP_K = 5
+
+
+# Per-request parameters that don't change what is being asked for.
+TRANSPORT_PARAMS = ("client", "timeout")
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "deadline", default=None
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Bound every request made inside, including nested prompts, tools and streams.
+
+    Nested deadlines can only shorten the time left. Also works as a decorator.
+    """
+    expires = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        expires = min(expires, current)
+    token = _deadline.set(expires)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time(expires: Optional[float] = None) -> Optional[float]:
+    """Seconds left before the current deadline, or None without one."""
+    expires = expires if expires is not None else _deadline.get()
+    if expires is None:
+        return None
+    left = expires - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("The deadline was exceeded.")
+    return left
+
+
+def _submit(pool: ThreadPoolExecutor, fn: Callable[..., Any], *args: Any) -> Future:
+    # Worker threads don't inherit context variables, so carry the deadline over.
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+class Tool:
+    """A Python callable the model can ask to run, described by its signature and docstring."""
+
+    TYPE_MAP = {
+        str: "string",
+        int: "integer",
+        float: "number",
+        bool: "boolean",
+        list: "array",
+        tuple: "array",
+        set: "array",
+        dict: "object",
+    }
+
+    def __init__(
+        self,
+        func: Callable[..., Any],
+        timeout: Optional[float] = None,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+    ):
+        # Partials and callable objects describe themselves through what they wrap.
+        target = func.func if isinstance(func, functools.partial) else func
+        self.func = func
+        self.timeout = timeout
+        self.name = name or getattr(target, "__name__", type(target).__name__)
+        self.description = description or inspect.getdoc(target) or ""
+        self.parameters = self._parameters_schema(func, target)
+
+    def __repr__(self) -> str:
+        return f"Tool({self.name!r})"
+
+    def _parameters_schema(
+        self, func: Callable[..., Any], target: Callable[..., Any]
+    ) -> Dict[str, Any]:
+        if not inspect.isroutine(target) and not inspect.isclass(target):
+            target = type(target).__call__
+        try:
+            hints = get_type_hints(target)
+        except (TypeError, NameError):
+            hints = {}
+
+        properties = {}
+        required = []
+        for name, param in inspect.signature(func).parameters.items():
+            if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+                continue
+            properties[name] = self._type_schema(hints.get(name))
+            if param.default is param.empty:
+                required.append(name)
+        return {"type": "object", "properties": properties, "required": required}
+
+    def _type_schema(self, hint: Any) -> Dict[str, Any]:
+        origin, args = get_origin(hint), get_args(hint)
+        # Optional[X] is Union[X, None]; other unions have no portable schema.
+        if origin is Union or getattr(origin, "__name__", None) == "UnionType":
+            options = [arg for arg in args if arg is not type(None)]
+            return self._type_schema(options[0] if len(options) == 1 else None)
+
+        schema = {"type": self.TYPE_MAP.get(origin or hint, "string")}
+        if schema["type"] == "array":
+            # OpenAI and Gemini reject arrays without items.
+            schema["items"] = (
+                self._type_schema(args[0])
+                if args and args[0] is not Ellipsis
+                else {"type": "string"}
+            )
+        return schema
+
+    def __call__(self, arguments: Dict[str, Any]) -> str:
+        result = self.func(**arguments)
+        return result if isinstance(result, str) else json.dumps(result, default=str)
+
+
+class _Node:
+    __slots__ = ("message", "parent", "length", "shared", "prefix")
+
+    def __init__(self, message: Dict[str, Any], parent: Optional["_Node"]):
+        self.message = message
+        self.parent = parent
+        self.length = parent.length + 1 if parent else 1
+        self.shared = False
+        # Set on fork points: (previous fork point, messages since it, cache points).
+        self.prefix: Optional[Tuple[Optional["_Node"], tuple, tuple]] = None
+
+
+class History:
+    """A list-like conversation history stored as a persistent linked list.
+
+    Appending never touches earlier messages, so forks share their common
+    prefix instead of copying it. Each fork point keeps the messages since the
+    previous one, so building a request only walks the messages added since
+    the last fork and branches hold no copy of the prefix.
+    """
+
+    def __init__(self, messages: Any = (), tail: Optional[_Node] = None):
+        self._tail = tail
+        self.extend(messages)
+
+    def append(self, message: Dict[str, Any]) -> None:
+        self._tail = _Node(message, self._tail)
+
+    def extend(self, messages: Any) -> None:
+        for message in messages:
+            self.append(message)
+
+    def pop(self) -> Dict[str, Any]:
+        if self._tail is None:
+            raise IndexError("pop from empty history")
+        message = self._tail.message
+        self._tail = self._tail.parent
+        return message
+
+    def fork(self) -> "History":
+        if self._tail is not None:
+            self._tail.shared = True
+        return History(tail=self._tail)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return self._prefix()[0]
+
+    def cache_points(self) -> List[int]:
+        """Indices of the messages where branches split off, oldest first."""
+        return self._prefix()[1]
+
+    def _prefix(self) -> Tuple[List[Dict[str, Any]], List[int]]:
+        pending = []
+        node = self._tail
+        while node is not None and node.prefix is None:
+            pending.append(node)
+            node = node.parent
+        pending.reverse()
+
+        # Fork points reached for the first time keep their segment.
+        fork, start = node, 0
+        for index, node in enumerate(pending):
+            if node.shared:
+                points = (fork.prefix[2] if fork else ()) + (node.length - 1,)
+                segment = tuple(n.message for n in pending[start : index + 1])
+                node.prefix = (fork, segment, points)
+                fork, start = node, index + 1
+
+        segments = []
+        node = fork
+        while node is not None:
+            segments.append(node.prefix[1])
+            node = node.prefix[0]
+        messages = [message for segment in reversed(segments) for message in segment]
+        messages.extend(node.message for node in pending[start:])
+        return messages, list(fork.prefix[2]) if fork else []
+
+    def __len__(self) -> int:
+        return self._tail.length if self._tail else 0
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.snapshot())
+
+    def __getitem__(self, index):
+        return self.snapshot()[index]
+
+    def __eq__(self, other: Any) -> bool:
+        return self.snapshot() == list(other)
+
+    def __repr__(self) -> str:
+        return f"History({self.snapshot()!r})"
+
+
+class ToolCall(NamedTuple):
+    id: str
+    name: str
+    arguments: Dict[str, Any]
 
 
 class AIProvider(ABC):
+    supports_n = False
+    max_embed_batch = 1
+
     @abstractmethod
     def create_client(self, base_url: Optional[str], api_key: Optional[str]):
         pass
@@ -41,8 +342,38 @@ class AIProvider(ABC):
     def extract_response(self, completion: Any) -> str:
         pass
 
+    def extract_responses(self, completion: Any) -> List[str]:
+        return [self.extract_response(completion)]
+
+    def format_tools(self, tools: List[Tool]) -> Any:
+        raise NotImplementedError(f"{type(self).__name__} doesn't support tools.")
+
+    def extract_tool_calls(self, completion: Any) -> List[ToolCall]:
+        return []
+
+    def tool_messages(
+        self, completion: Any, calls: List[ToolCall], results: List[str]
+    ) -> List[Dict[str, Any]]:
+        raise NotImplementedError(f"{type(self).__name__} doesn't support tools.")
+
+    def extract_usage(self, completion: Any) -> Optional[Dict[str, int]]:
+        return None
+
+    def continuation_messages(self, partial: str) -> List[Dict[str, Any]]:
+        """Messages that make the model continue an interrupted reply."""
+        return [
+            {"role": "assistant", "content": partial},
+            {"role": "user", "content": CONTINUE_PROMPT},
+        ]
+
+    def embed(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        raise NotImplementedError(f"{type(self).__name__} doesn't support embeddings.")
+
 
 class OpenAIProvider(AIProvider):
+    supports_n = True
+    max_embed_batch = 2048
+
     def create_client(
         self,
         base_url: Optional[str],
@@ -63,10 +394,12 @@ class OpenAIProvider(AIProvider):
             "stream": stream,
         }
 
-        if any(model in kwargs["model"] for model in self.REASONING_MODELS):
-            completion_params["max_completion_tokens"] = kwargs.get("max_tokens", 4096)
+        if any(model in kwargs["model"] for model in REASONING_MODELS):
+            completion_params["max_completion_tokens"] = kwargs.get(
+                "max_tokens", DEFAULT_MAX_TOKENS
+            )
             completion_params["reasoning_effort"] = kwargs.get(
-                "reasoning_effort", "high"
+                "reasoning_effort", DEFAULT_REASONING_EFFORT
             )
         else:
             completion_params.update(
@@ -76,18 +409,119 @@ class OpenAIProvider(AIProvider):
                 }
             )
 
-        return kwargs["client"].chat.completions.create(**completion_params)
+        if kwargs.get("tools"):
+            completion_params["tools"] = self.format_tools(kwargs["tools"])
+        if kwargs.get("n", 1) > 1:
+            completion_params["n"] = kwargs["n"]
+        if self._accepts_prediction(kwargs):
+            completion_params["prediction"] = {
+                "type": "content",
+                "content": kwargs["prediction"],
+            }
+            if stream:
+                # The prediction token counts arrive in a final usage-only chunk.
+                completion_params["stream_options"] = {"include_usage": True}
+
+        client = kwargs["client"]
+        if kwargs.get("timeout") is not None:
+            # SDK retries would each get the full timeout and overrun the deadline,
+            # so Chat retries instead, giving each attempt only the time left.
+            client = client.with_options(timeout=kwargs["timeout"], max_retries=0)
+        return client.chat.completions.create(**completion_params)
+
+    def _accepts_prediction(self, kwargs: Dict[str, Any]) -> bool:
+        # Predicted outputs aren't available for reasoning models, tools or n > 1.
+        return bool(
+            kwargs.get("prediction")
+            and not any(model in kwargs["model"] for model in REASONING_MODELS)
+            and not kwargs.get("tools")
+            and kwargs.get("n", 1) == 1
+        )
 
     def iter_chunks(self, completion: Any) -> Iterator[str]:
-        return (
-            chunk.choices[0].delta.content
-            for chunk in completion
-            if chunk.choices[0].delta.content
-        )
+        for chunk in completion:
+            if getattr(chunk, "usage", None):
+                # Keep the streamed usage where extract_usage() finds it.
+                completion.usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
     def extract_response(self, completion: Any) -> str:
         return completion.choices[0].message.content
 
+    def extract_responses(self, completion: Any) -> List[str]:
+        return [choice.message.content for choice in completion.choices]
+
+    def extract_usage(self, completion: Any) -> Optional[Dict[str, int]]:
+        usage = getattr(completion, "usage", None)
+        if usage is None:
+            return None
+        details = usage.completion_tokens_details
+        return {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "accepted_prediction_tokens": getattr(
+                details, "accepted_prediction_tokens", None
+            )
+            or 0,
+            "rejected_prediction_tokens": getattr(
+                details, "rejected_prediction_tokens", None
+            )
+            or 0,
+        }
+
+    def embed(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        client = kwargs["client"]
+        if kwargs.get("timeout") is not None:
+            client = client.with_options(timeout=kwargs["timeout"], max_retries=0)
+        response = client.embeddings.create(model=kwargs["model"], input=texts)
+        return [item.embedding for item in sorted(response.data, key=lambda x: x.index)]
+
+    def format_tools(self, tools: List[Tool]) -> List[Dict[str, Any]]:
+        return [
+            {
+                "type": "function",
+                "function": {
+                    "name": tool.name,
+                    "description": tool.description,
+                    "parameters": tool.parameters,
+                },
+            }
+            for tool in tools
+        ]
+
+    def extract_tool_calls(self, completion: Any) -> List[ToolCall]:
+        return [
+            ToolCall(
+                call.id, call.function.name, json.loads(call.function.arguments or "{}")
+            )
+            for call in completion.choices[0].message.tool_calls or []
+        ]
+
+    def tool_messages(
+        self, completion: Any, calls: List[ToolCall], results: List[str]
+    ) -> List[Dict[str, Any]]:
+        message = completion.choices[0].message
+        assistant = {
+            "role": "assistant",
+            "content": message.content,
+            "tool_calls": [
+                {
+                    "id": call.id,
+                    "type": "function",
+                    "function": {
+                        "name": call.function.name,
+                        "arguments": call.function.arguments,
+                    },
+                }
+                for call in message.tool_calls
+            ],
+        }
+        return [assistant] + [
+            {"role": "tool", "tool_call_id": call.id, "content": result}
+            for call, result in zip(calls, results)
+        ]
+
 
 class AnthropicProvider(AIProvider):
     def create_client(
@@ -100,23 +534,100 @@ class AnthropicProvider(AIProvider):
     def create_completion(self, stream: bool, **kwargs: Any):
         params = {
             "model": kwargs["model"],
-            "messages": kwargs["messages"],
+            "messages": self._mark_cache_points(
+                kwargs["messages"], kwargs.get("cache_points")
+            ),
             "max_tokens": kwargs["max_tokens"],
             "temperature": kwargs["temperature"],
             "system": kwargs["system"],
         }
-        client = kwargs["client"].messages
+        if kwargs.get("tools"):
+            params["tools"] = self.format_tools(kwargs["tools"])
+        client = kwargs["client"]
+        if kwargs.get("timeout") is not None:
+            client = client.with_options(timeout=kwargs["timeout"], max_retries=0)
+        client = client.messages
         return client.stream(**params) if stream else client.create(**params)
 
+    def _mark_cache_points(
+        self, messages: List[Dict[str, Any]], cache_points: Optional[List[int]]
+    ) -> List[Dict[str, Any]]:
+        # Branches share everything up to their fork point, so a cache
+        # breakpoint there lets every branch reuse the cached prefix.
+        if not cache_points:
+            return messages
+
+        messages = list(messages)
+        for index in cache_points[-MAX_CACHE_POINTS:]:
+            message = messages[index]
+            content = message["content"]
+            if isinstance(content, str):
+                content = [{"type": "text", "text": content}]
+            content = [dict(block) for block in content]
+            content[-1]["cache_control"] = {"type": "ephemeral"}
+            messages[index] = {**message, "content": content}
+        return messages
+
     def iter_chunks(self, completion: Any) -> Iterator[str]:
         with completion as stream:
             yield from stream.text_stream
 
+    def continuation_messages(self, partial: str) -> List[Dict[str, Any]]:
+        # Prefill: the model carries on from a final assistant turn, which
+        # mustn't end in whitespace.
+        return [{"role": "assistant", "content": partial.rstrip()}]
+
     def extract_response(self, completion: Any) -> str:
         return completion.content[0].text
 
+    def format_tools(self, tools: List[Tool]) -> List[Dict[str, Any]]:
+        return [
+            {
+                "name": tool.name,
+                "description": tool.description,
+                "input_schema": tool.parameters,
+            }
+            for tool in tools
+        ]
+
+    def extract_tool_calls(self, completion: Any) -> List[ToolCall]:
+        return [
+            ToolCall(block.id, block.name, block.input)
+            for block in completion.content
+            if block.type == "tool_use"
+        ]
+
+    def tool_messages(
+        self, completion: Any, calls: List[ToolCall], results: List[str]
+    ) -> List[Dict[str, Any]]:
+        content = []
+        for block in completion.content:
+            if block.type == "text":
+                content.append({"type": "text", "text": block.text})
+            elif block.type == "tool_use":
+                content.append(
+                    {
+                        "type": "tool_use",
+                        "id": block.id,
+                        "name": block.name,
+                        "input": block.input,
+                    }
+                )
+        return [
+            {"role": "assistant", "content": content},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "tool_result", "tool_use_id": call.id, "content": result}
+                    for call, result in zip(calls, results)
+                ],
+            },
+        ]
+
 
 class GoogleProvider(AIProvider):
+    max_embed_batch = 100
+
     def create_client(
         self,
         base_url: Optional[str],
@@ -127,7 +638,9 @@ class GoogleProvider(AIProvider):
     def create_completion(self, stream: bool, **kwargs: Any):
         contents = []
         for msg in kwargs["messages"]:
-            if msg.get("content"):
+            if msg.get("parts"):
+                contents.append(types.Content(role=msg["role"], parts=msg["parts"]))
+            elif msg.get("content"):
                 contents.append(msg["content"])
 
         config = None
@@ -136,6 +649,8 @@ class GoogleProvider(AIProvider):
             system_instruction
             or kwargs.get("temperature") is not None
             or kwargs.get("max_tokens")
+            or kwargs.get("tools")
+            or kwargs.get("timeout") is not None
         ):
             config_params = {}
             if system_instruction:
@@ -144,6 +659,12 @@ class GoogleProvider(AIProvider):
                 config_params["temperature"] = kwargs["temperature"]
             if kwargs.get("max_tokens"):
                 config_params["max_output_tokens"] = kwargs["max_tokens"]
+            if kwargs.get("tools"):
+                config_params["tools"] = self.format_tools(kwargs["tools"])
+            if kwargs.get("timeout") is not None:
+                config_params["http_options"] = types.HttpOptions(
+                    timeout=int(kwargs["timeout"] * 1000)
+                )
             config = GenerateContentConfig(**config_params)
 
         completion_params = {
@@ -163,9 +684,741 @@ class GoogleProvider(AIProvider):
     def iter_chunks(self, completion: Any) -> Iterator[str]:
         return (chunk.text for chunk in completion if chunk.text)
 
+    def embed(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        config = None
+        if kwargs.get("timeout") is not None:
+            config = types.EmbedContentConfig(
+                http_options=types.HttpOptions(timeout=int(kwargs["timeout"] * 1000))
+            )
+        response = kwargs["client"].models.embed_content(
+            model=kwargs["model"], contents=texts, config=config
+        )
+        return [embedding.values for embedding in response.embeddings]
+
     def extract_response(self, completion: Any) -> str:
         return completion.text
 
+    def format_tools(self, tools: List[Tool]) -> List[types.Tool]:
+        declarations = [
+            types.FunctionDeclaration(
+                name=tool.name,
+                description=tool.description,
+                parameters=tool.parameters if tool.parameters["properties"] else None,
+            )
+            for tool in tools
+        ]
+        return [types.Tool(function_declarations=declarations)]
+
+    def extract_tool_calls(self, completion: Any) -> List[ToolCall]:
+        return [
+            ToolCall(call.id or call.name, call.name, dict(call.args or {}))
+            for call in completion.function_calls or []
+        ]
+
+    def tool_messages(
+        self, completion: Any, calls: List[ToolCall], results: List[str]
+    ) -> List[Dict[str, Any]]:
+        return [
+            {"role": "model", "parts": completion.candidates[0].content.parts},
+            {
+                "role": "user",
+                "parts": [
+                    types.Part.from_function_response(
+                        name=call.name, response={"result": result}
+                    )
+                    for call, result in zip(calls, results)
+                ],
+            },
+        ]
+
+
+def _fingerprint(request: Dict[str, Any]) -> str:
+    encoded = json.dumps(request, sort_keys=True, default=repr)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class _Recording:
+    def __init__(self, completion: Any, request: Dict[str, Any], started: float):
+        self.completion = completion
+        self.request = request
+        self.started = started
+        self.latency = time.monotonic() - started
+
+
+class CassetteProvider(AIProvider):
+    """Wraps a provider to record its traffic into a cassette, or to replay it offline."""
+
+    def __init__(self, provider: AIProvider, cassette: "Cassette"):
+        self.provider = provider
+        self.cassette = cassette
+
+    @property
+    def replaying(self) -> bool:
+        return self.cassette.mode == "replay"
+
+    def create_client(self, base_url: Optional[str], api_key: Optional[str]):
+        if self.replaying:
+            return None
+        return self.provider.create_client(base_url, api_key)
+
+    def create_completion(self, stream: bool, **kwargs: Any):
+        request = {k: v for k, v in kwargs.items() if k not in TRANSPORT_PARAMS}
+        request["messages"] = list(kwargs["messages"])
+        request["stream"] = stream
+
+        if self.replaying:
+            interaction = self.cassette.take(request)
+            if not stream and self.cassette.realtime:
+                time.sleep(interaction["latency"])
+            return interaction
+
+        started = time.monotonic()
+        completion = self.provider.create_completion(stream, **kwargs)
+        return _Recording(completion, request, started)
+
+    def iter_chunks(self, completion: Any) -> Iterator[str]:
+        if self.replaying:
+            for delay, chunk in completion["chunks"]:
+                if self.cassette.realtime:
+                    time.sleep(delay)
+                yield chunk
+            return
+
+        chunks = []
+        last = completion.started
+        for chunk in self.provider.iter_chunks(completion.completion):
+            now = time.monotonic()
+            chunks.append([now - last, chunk])
+            last = now
+            yield chunk
+        self.cassette.record(
+            completion.request,
+            last - completion.started,
+            chunks=chunks,
+            usage=self.provider.extract_usage(completion.completion),
+        )
+
+    def extract_response(self, completion: Any) -> str:
+        if self.replaying:
+            return completion["response"]
+
+        response = self.provider.extract_response(completion.completion)
+        self.cassette.record(
+            completion.request,
+            completion.latency,
+            response=response,
+            usage=self.provider.extract_usage(completion.completion),
+        )
+        return response
+
+    def extract_usage(self, completion: Any) -> Optional[Dict[str, int]]:
+        if self.replaying:
+            return completion.get("usage")
+        return self.provider.extract_usage(completion.completion)
+
+    def continuation_messages(self, partial: str) -> List[Dict[str, Any]]:
+        return self.provider.continuation_messages(partial)
+
+    def format_tools(self, tools: List[Tool]) -> Any:
+        return self.provider.format_tools(tools)
+
+    def extract_tool_calls(self, completion: Any) -> List[ToolCall]:
+        # Only text replies are captured, so replayed turns never call tools.
+        if self.replaying:
+            return []
+        return self.provider.extract_tool_calls(completion.completion)
+
+    def tool_messages(
+        self, completion: Any, calls: List[ToolCall], results: List[str]
+    ) -> List[Dict[str, Any]]:
+        return self.provider.tool_messages(completion.completion, calls, results)
+
+
+class Cassette:
+    """A JSON file of recorded provider exchanges, including inter-chunk timings.
+
+    In "record" mode every exchange is appended and saved as it completes. In
+    "replay" mode requests are answered from the file in recorded order,
+    instantly or, with realtime=True, at the original pace.
+    """
+
+    MODES = ("record", "replay")
+
+    def __init__(self, path: str, mode: str = "replay", realtime: bool = False):
+        if mode not in self.MODES:
+            raise ValueError(
+                f"The cassette mode '{mode}' is not supported. "
+                f"Use one of: {', '.join(self.MODES)}."
+            )
+        self.path = path
+        self.mode = mode
+        self.realtime = realtime
+        self.interactions: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+        if mode == "replay":
+            with open(path, encoding="utf-8") as file:
+                self.interactions = json.load(file)["interactions"]
+            self._unused = list(self.interactions)
+
+    def wrap(self, provider: AIProvider) -> CassetteProvider:
+        return CassetteProvider(provider, self)
+
+    def take(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        key = _fingerprint(request)
+        with self._lock:
+            for i, interaction in enumerate(self._unused):
+                if interaction["key"] == key:
+                    return self._unused.pop(i)
+        raise LookupError(
+            f"No recorded exchange in '{self.path}' matches this request "
+            f"to '{request['model']}'. Record the cassette again."
+        )
+
+    def record(self, request: Dict[str, Any], latency: float, **reply: Any) -> None:
+        interaction = {
+            "key": _fingerprint(request),
+            "request": json.loads(json.dumps(request, default=repr)),
+            "latency": latency,
+            **reply,
+        }
+        with self._lock:
+            self.interactions.append(interaction)
+            self.save()
+
+    def save(self) -> None:
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({"interactions": self.interactions}, file, indent=2)
+        os.replace(temp_path, self.path)
+
+
+class ClientCache:
+    """Shares one SDK client, and its connection pool, per provider, base URL and key."""
+
+    def __init__(self):
+        self._clients: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self, provider: AIProvider, base_url: Optional[str], api_key: Optional[str]
+    ):
+        key = (type(provider).__name__, base_url, api_key)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = provider.create_client(base_url, api_key)
+            return self._clients[key]
+
+
+class RateLimiter:
+    """A thread-safe token bucket allowing `rate` requests per second."""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how long to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self) -> None:
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+
+def _is_rate_limit(error: BaseException) -> bool:
+    # OpenAI and Anthropic errors carry status_code, Google's carry code.
+    return 429 in (getattr(error, "status_code", None), getattr(error, "code", None))
+
+
+def _is_auth_error(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return status in (401, 403)
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_disconnect(error: BaseException) -> bool:
+    # Only transport errors: local OSErrors, like a cassette that can't be
+    # saved, and DeadlineExceeded must not resume or retry a request.
+    return isinstance(
+        error,
+        (
+            ConnectionError,
+            httpx.TransportError,
+            openai.APIConnectionError,
+            anthropic.APIConnectionError,
+        ),
+    )
+
+
+def _is_retryable(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return _is_disconnect(error) or (
+        isinstance(status, int) and (status in (408, 409, 429) or status >= 500)
+    )
+
+
+def _with_retries(send: Callable[[], Any], retries: int = DEFAULT_MAX_RETRIES) -> Any:
+    """Call send(), retrying transient errors with exponential backoff.
+
+    For requests the SDK doesn't retry itself. Never sleeps past the deadline.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return send()
+        except Exception as e:
+            if attempt == retries or not _is_retryable(e):
+                raise
+            delay = _retry_after(e) or min(
+                RETRY_BACKOFF * 2**attempt, MAX_RETRY_BACKOFF
+            )
+            left = remaining_time()
+            if left is not None and delay >= left:
+                raise
+            time.sleep(delay)
+
+
+class KeyPool:
+    """Spreads requests over several API keys for the same provider.
+
+    Each request goes to the key with the fewest requests in flight, or to the
+    next key in turn with strategy="round_robin". A key that answers 429 cools
+    down, for Retry-After seconds when the provider sends it, and so does one
+    with KEY_FAILURE_LIMIT server errors in a row. A key answering 401 or 403
+    is taken out of the pool. In each case the request moves to another key.
+    Clients are kept per key.
+    """
+
+    def __init__(
+        self,
+        keys: List[str],
+        strategy: str = "least_loaded",
+        cooldown: float = DEFAULT_KEY_COOLDOWN,
+    ):
+        if not keys:
+            raise ValueError("A KeyPool needs at least one API key.")
+        if strategy not in KEY_STRATEGIES:
+            raise ValueError(
+                f"Unknown strategy '{strategy}'. Use one of: {', '.join(KEY_STRATEGIES)}."
+            )
+        self.keys = list(keys)
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self.clients = ClientCache()
+        self._stats = [
+            {
+                "requests": 0,
+                "in_flight": 0,
+                "rate_limited": 0,
+                "errors": 0,
+                "rejected": False,
+            }
+            for _ in self.keys
+        ]
+        self._cooling_until = [0.0] * len(self.keys)
+        self._failures = [0] * len(self.keys)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def call(self, request: Callable[..., Any], hold: bool = False) -> Any:
+        """Run request(key) on a healthy key, moving to another one if it fails.
+
+        With hold=True the key stays leased after request returns, for results
+        that outlive the call like streams, and request(key, release) must call
+        release(error=None) once it's done with the key.
+        """
+        tried = set()
+        for attempt in range(len(self.keys)):
+            index = self._lease(tried)
+            tried.add(index)
+            release = functools.partial(self._release_once, index, [False])
+            try:
+                if hold:
+                    return request(self.keys[index], release)
+                result = request(self.keys[index])
+            except Exception as e:
+                release(e)
+                if (
+                    (_is_auth_error(e) or _is_retryable(e))
+                    and attempt < len(self.keys) - 1
+                    and not all(stats["rejected"] for stats in self._stats)
+                ):
+                    continue
+                raise
+            release()
+            return result
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Usage per key, with keys shortened to their last 4 characters."""
+        with self._lock:
+            now = time.monotonic()
+            return [
+                {
+                    "key": f"...{key[-4:]}",
+                    **stats,
+                    "cooldown": max(0.0, until - now),
+                }
+                for key, stats, until in zip(
+                    self.keys, self._stats, self._cooling_until
+                )
+            ]
+
+    def _lease(self, tried: Collection[int] = ()) -> int:
+        while True:
+            with self._lock:
+                usable = [
+                    i for i, stats in enumerate(self._stats) if not stats["rejected"]
+                ]
+                if not usable:
+                    raise RuntimeError("Every API key in the pool was rejected.")
+                now = time.monotonic()
+                ready = [i for i in usable if self._cooling_until[i] <= now]
+                # A retry goes to a key it hasn't tried yet when one is ready.
+                ready = [i for i in ready if i not in tried] or ready
+                if ready:
+                    # Ties go to the next key in turn, so idle keys share the load.
+                    def turn(i: int) -> int:
+                        return (i - self._next) % len(self.keys)
+
+                    if self.strategy == "round_robin":
+                        index = min(ready, key=turn)
+                    else:
+                        index = min(
+                            ready, key=lambda i: (self._stats[i]["in_flight"], turn(i))
+                        )
+                    self._next = index + 1
+                    self._stats[index]["requests"] += 1
+                    self._stats[index]["in_flight"] += 1
+                    return index
+                wait = min(self._cooling_until[i] for i in usable) - now
+
+            left = remaining_time()
+            if left is not None and wait > left:
+                raise DeadlineExceeded(
+                    "Every API key is cooling down past the deadline."
+                )
+            time.sleep(wait)
+
+    def _release_once(
+        self, index: int, released: List[bool], error: Optional[BaseException] = None
+    ) -> None:
+        with self._lock:
+            if released[0]:
+                return
+            released[0] = True
+        self._release(index, error)
+
+    def _release(self, index: int, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            stats = self._stats[index]
+            stats["in_flight"] -= 1
+            if error is None:
+                self._failures[index] = 0
+                return
+            if _is_rate_limit(error):
+                stats["rate_limited"] += 1
+                self._cooling_until[index] = time.monotonic() + (
+                    _retry_after(error) or self.cooldown
+                )
+                return
+
+            stats["errors"] += 1
+            if _is_auth_error(error):
+                stats["rejected"] = True
+            elif _is_retryable(error):
+                # Errors caused by the request itself say nothing about the key.
+                self._failures[index] += 1
+                if self._failures[index] >= KEY_FAILURE_LIMIT:
+                    self._failures[index] = 0
+                    self._cooling_until[index] = time.monotonic() + self.cooldown
+
+
+class ResponseCache:
+    """A thread-safe LRU cache of response texts."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: str, response: str) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = response
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+_in_flight: Dict[str, Future] = {}
+_in_flight_lock = threading.Lock()
+
+
+def _forget_in_flight(key: str, entry: Future) -> None:
+    with _in_flight_lock:
+        if _in_flight.get(key) is entry:
+            del _in_flight[key]
+
+
+class _SharedStream:
+    """Fans one upstream chunk iterator out to every caller that joined it.
+
+    Each consumer first replays the chunks already received, then follows the
+    live tail. Whichever consumer runs out of buffered chunks pulls the next one.
+    """
+
+    def __init__(self, chunks: Iterator[str], on_done: Callable[[], None]):
+        self._chunks = chunks
+        self._on_done = on_done
+        self._received: List[str] = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._pulling = False
+        self._cond = threading.Condition()
+
+    def __iter__(self) -> Iterator[str]:
+        index = 0
+        while True:
+            with self._cond:
+                while index == len(self._received) and self._pulling and not self._done:
+                    self._cond.wait()
+                if index < len(self._received):
+                    chunk = self._received[index]
+                elif self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                else:
+                    self._pulling = True
+                    chunk = None
+
+            if chunk is None:
+                self._pull()
+                continue
+
+            index += 1
+            yield chunk
+
+    def _pull(self) -> None:
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._finish(None)
+        except BaseException as e:
+            self._finish(e)
+        else:
+            with self._cond:
+                self._received.append(chunk)
+                self._pulling = False
+                self._cond.notify_all()
+
+    def _finish(self, error: Optional[BaseException]) -> None:
+        with self._cond:
+            self._done = True
+            self._error = error
+            self._pulling = False
+            self._cond.notify_all()
+        self._on_done()
+
+
+class _LeasedStream:
+    """A stream that keeps its KeyPool key leased until it's exhausted or closed."""
+
+    def __init__(
+        self,
+        provider: AIProvider,
+        completion: Any,
+        release: Callable[..., None],
+    ):
+        self.completion = completion
+        self._chunks = provider.iter_chunks(completion)
+        # Lazy SDK streams only send the request when first read, so pull the
+        # first chunk now to let a 429 move the request to another key.
+        self._first = list(itertools.islice(self._chunks, 1))
+        self._release = release
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            yield from self._first
+            yield from self._chunks
+        except Exception as e:
+            self._release(e)
+            raise
+        finally:
+            self._release()
+
+    def close(self) -> None:
+        try:
+            if hasattr(self._chunks, "close"):
+                self._chunks.close()
+            if hasattr(self.completion, "close"):
+                self.completion.close()
+        finally:
+            self._release()
+
+    def __del__(self) -> None:
+        # Streams dropped without being read still give their key back.
+        if hasattr(self, "_release"):
+            self._release()
+
+
+class _StreamEnd:
+    def __init__(self, error: Optional[BaseException] = None):
+        self.error = error
+
+
+class _Branch:
+    def __init__(self, buffer: int):
+        self.queue: queue.Queue = queue.Queue(maxsize=buffer)
+        self.closed = threading.Event()
+
+    def put(self, item: Any) -> None:
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            while True:
+                item = self.queue.get()
+                if isinstance(item, _StreamEnd):
+                    if item.error is not None:
+                        raise item.error
+                    return
+                yield item
+        finally:
+            self.closed.set()
+
+
+class ChatStream:
+    """A streamed reply that can be iterated once or multicast to several consumers.
+
+    Each consumer gets a bounded buffer, so a slow consumer holds back the
+    upstream instead of letting chunks pile up in memory.
+    """
+
+    def __init__(self, chunks: Iterator[str]):
+        self._chunks = chunks
+        self._parts: List[str] = []
+
+    def __iter__(self) -> Iterator[str]:
+        for chunk in self._chunks:
+            self._parts.append(chunk)
+            yield chunk
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def tee(
+        self, n: int = 2, buffer: int = DEFAULT_STREAM_BUFFER
+    ) -> List[Iterator[str]]:
+        branches = [_Branch(buffer) for _ in range(n)]
+        threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._pump, branches),
+            daemon=True,
+        ).start()
+        return [iter(branch) for branch in branches]
+
+    def multicast(
+        self, *sinks: Callable[[str], Any], buffer: int = DEFAULT_STREAM_BUFFER
+    ) -> str:
+        branches = [_Branch(buffer) for _ in sinks]
+        errors: List[BaseException] = []
+        threads = [
+            threading.Thread(target=self._feed, args=(sink, branch, errors))
+            for sink, branch in zip(sinks, branches)
+        ]
+        for thread in threads:
+            thread.start()
+        self._pump(branches)
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        return self.text
+
+    def _pump(self, branches: List[_Branch]) -> None:
+        end = _StreamEnd()
+        try:
+            for chunk in self:
+                for branch in branches:
+                    branch.put(chunk)
+        except BaseException as e:
+            end = _StreamEnd(e)
+        finally:
+            for branch in branches:
+                branch.put(end)
+
+    def _feed(
+        self,
+        sink: Callable[[str], Any],
+        branch: _Branch,
+        errors: List[BaseException],
+    ) -> None:
+        failed = False
+        try:
+            for chunk in branch:
+                # A failed sink keeps draining so it never stalls the others.
+                if not failed:
+                    try:
+                        sink(chunk)
+                    except Exception as e:
+                        errors.append(e)
+                        failed = True
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            if hasattr(sink, "close"):
+                sink.close()
+
+
+class FileSink:
+    """A multicast sink that writes each chunk to a file as it arrives."""
+
+    def __init__(self, filename: str, encoding: str = "utf-8"):
+        self.file = open(filename, "w", encoding=encoding)
+
+    def __call__(self, chunk: str) -> None:
+        self.file.write(chunk)
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
 
 class Chat:
     PROVIDER_MAP = {
@@ -177,6 +1430,10 @@ class Chat:
                 "gpt4.1": "gpt-4.1-2025-04-14",
                 "gpt4.1-mini": "gpt-4.1-mini-2025-04-14",
             },
+            "embedding_models": {
+                "embed-small": "text-embedding-3-small",
+                "embed-large": "text-embedding-3-large",
+            },
         },
         "anthropic": {
             "provider": AnthropicProvider,
@@ -193,6 +1450,10 @@ class Chat:
                 "gemini-pro": "gemini-2.5-pro-preview-06-05",
                 "gemini-flash": "gemini-2.5-flash-preview-05-20",
             },
+            "embedding_models": {
+                "gemini-embed": "gemini-embedding-001",
+                "text-embedding": "text-embedding-004",
+            },
         },
     }
 
@@ -204,18 +1465,76 @@ class Chat:
         temperature: float = DEFAULT_TEMPERATURE,
         provider: Optional[str] = None,
         base_url: Optional[str] = None,
-        api_key: Optional[str] = None,
+        api_key: Union[str, List[str], KeyPool, None] = None,
         reasoning_effort: str = DEFAULT_REASONING_EFFORT,
+        coalesce: bool = False,
+        tools: Optional[List[Callable[..., Any]]] = None,
+        tool_timeout: Optional[float] = None,
+        max_tool_rounds: int = DEFAULT_MAX_TOOL_ROUNDS,
+        cassette: Optional[Cassette] = None,
+        client_cache: Optional[ClientCache] = None,
+        max_resumes: int = DEFAULT_MAX_RESUMES,
     ):
         self.provider = self._get_provider(model, provider)
-        self.client = self.provider.create_client(base_url, api_key)
+        if cassette:
+            self.provider = cassette.wrap(self.provider)
+        if isinstance(api_key, (list, tuple)):
+            api_key = KeyPool(api_key)
+        self.key_pool = api_key if isinstance(api_key, KeyPool) else None
+        if self.key_pool:
+            self.clients = client_cache or self.key_pool.clients
+            self.client = self.clients.get(
+                self.provider, base_url, self.key_pool.keys[0]
+            )
+        elif client_cache:
+            self.client = client_cache.get(self.provider, base_url, api_key)
+        else:
+            self.client = self.provider.create_client(base_url, api_key)
         self.model = self._resolve_model_name(model, provider)
         self.system = system
         self.max_tokens = max_tokens
         self.temperature = temperature
         self.api_key = api_key
         self.reasoning_effort = reasoning_effort
-        self.messages: List[Dict[str, str]] = []
+        self.base_url = base_url
+        self.coalesce = coalesce
+        self.tools = [
+            tool if isinstance(tool, Tool) else Tool(tool) for tool in tools or []
+        ]
+        self.tool_timeout = tool_timeout
+        self.max_tool_rounds = max_tool_rounds
+        self.max_resumes = max_resumes
+        self.last_usage: Optional[Dict[str, int]] = None
+        self.messages = History()
+
+    @property
+    def messages(self) -> History:
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages: Any) -> None:
+        self._messages = (
+            messages if isinstance(messages, History) else History(messages)
+        )
+
+    def fork(self) -> "Chat":
+        """Branch the conversation without copying the history so far."""
+        branch = copy.copy(self)
+        branch.messages = self.messages.fork()
+        return branch
+
+    def explore(
+        self, user_messages: List[str], max_workers: Optional[int] = None
+    ) -> List[Tuple["Chat", str]]:
+        """Send each message on its own fork, concurrently, and return (fork, response) pairs."""
+        branches = [self.fork() for _ in user_messages]
+        with ThreadPoolExecutor(max_workers=max_workers or len(branches)) as pool:
+            futures = [
+                _submit(pool, branch, message)
+                for branch, message in zip(branches, user_messages)
+            ]
+            responses = [future.result() for future in futures]
+        return list(zip(branches, responses))
 
     def _get_provider(self, model: str, provider: Optional[str]) -> AIProvider:
         if provider:
@@ -250,41 +1569,466 @@ class Chat:
 
         return provider_info["models"].get(model, model)
 
-    def __call__(self, user_message: str, stream: bool = False):
+    def __call__(
+        self, user_message: str, stream: bool = False, prediction: Optional[str] = None
+    ):
+        """Send a message. prediction is the expected reply, when most of it is known."""
         self.messages.append({"role": "user", "content": user_message})
-        return self._generate_new_response(stream)
+        return self._generate_new_response(stream, prediction)
+
+    def _generate_new_response(self, stream: bool, prediction: Optional[str] = None):
+        if self.tools:
+            return self._generate_with_tools(stream)
 
-    def _generate_new_response(self, stream: bool):
-        completion = self._create_completion(stream)
+        completion = self._create_completion(stream, prediction=prediction)
 
         if stream:
-            return self._stream_response(completion)
+            return ChatStream(self._stream_response(completion, _deadline.get()))
 
         response = self.provider.extract_response(completion)
+        self.last_usage = self.provider.extract_usage(completion)
         self.messages.append({"role": "assistant", "content": response})
         return response
 
-    def _create_completion(self, stream: bool):
+    def _generate_with_tools(self, stream: bool):
+        # Tool rounds need the whole reply to see the calls, so a streamed
+        # request yields the final answer as a single chunk.
+        for _ in range(self.max_tool_rounds):
+            completion = self._create_completion(False)
+            calls = self.provider.extract_tool_calls(completion)
+            if not calls:
+                break
+            results = self._run_tools(calls)
+            self.messages.extend(
+                self.provider.tool_messages(completion, calls, results)
+            )
+        else:
+            raise RuntimeError(
+                f"The model kept calling tools after {self.max_tool_rounds} rounds."
+            )
+
+        response = self.provider.extract_response(completion)
+        self.last_usage = self.provider.extract_usage(completion)
+        self.messages.append({"role": "assistant", "content": response})
+        return ChatStream(iter([response])) if stream else response
+
+    def _run_tools(self, calls: List[ToolCall]) -> List[str]:
+        tools = {tool.name: tool for tool in self.tools}
+        pool = ThreadPoolExecutor(max_workers=len(calls))
+        futures = [
+            _submit(pool, self._run_tool, tools.get(call.name), call) for call in calls
+        ]
+        started = time.monotonic()
+
+        results = []
+        for call, future in zip(calls, futures):
+            tool = tools.get(call.name)
+            timeout = (tool.timeout if tool else None) or self.tool_timeout
+            try:
+                limit = None
+                if timeout is not None:
+                    limit = max(0.0, started + timeout - time.monotonic())
+                left = remaining_time()
+                if left is not None and (limit is None or left < limit):
+                    limit = left
+                results.append(future.result(timeout=limit))
+            except concurrent.futures.TimeoutError:
+                remaining_time()  # Raises if the deadline, not the tool, ran out.
+                results.append(f"Error: '{call.name}' timed out after {timeout}s.")
+
+        pool.shutdown(wait=False)
+        return results
+
+    def _run_tool(self, tool: Optional[Tool], call: ToolCall) -> str:
+        if tool is None:
+            return f"Error: there is no tool named '{call.name}'."
+        try:
+            return tool(call.arguments)
+        except Exception as e:
+            return f"Error: {e}"
+
+    def best_of(
+        self,
+        user_message: str,
+        n: int,
+        judge: Callable[[str, str], float],
+        threshold: Optional[float] = None,
+        native_n: bool = True,
+    ) -> str:
+        """Generate n candidates concurrently and keep the one the judge scores highest.
+
+        With a threshold, the first candidate scoring at least that much wins
+        and the rest are abandoned. Only the winner is added to the history.
+        """
+        self.messages.append({"role": "user", "content": user_message})
+
+        if native_n and threshold is None and self.provider.supports_n:
+            completion = self._create_completion(False, n=n)
+            candidates = self.provider.extract_responses(completion)
+            winner, best_score = None, float("-inf")
+            with ThreadPoolExecutor(max_workers=max(1, len(candidates))) as pool:
+                futures = [_submit(pool, judge, user_message, c) for c in candidates]
+                if len(candidates) < n:
+                    # OpenAI-compatible local servers may return fewer choices.
+                    winner, best_score = self._race_candidates(
+                        user_message, n - len(candidates), judge, None
+                    )
+                for candidate, future in zip(candidates, futures):
+                    score = future.result()
+                    if score > best_score:
+                        winner, best_score = candidate, score
+        else:
+            winner, _ = self._race_candidates(user_message, n, judge, threshold)
+
+        self.messages.append({"role": "assistant", "content": winner})
+        return winner
+
+    def _race_candidates(
+        self,
+        user_message: str,
+        n: int,
+        judge: Callable[[str, str], float],
+        threshold: Optional[float],
+    ) -> Tuple[Optional[str], float]:
+        stop = threading.Event()
+
+        def candidate():
+            text = self._generate_candidate(stop, early_exit=threshold is not None)
+            if text is None:
+                return None, float("-inf")
+            score = judge(user_message, text)
+            if threshold is not None and score >= threshold:
+                stop.set()
+            return text, score
+
+        pool = ThreadPoolExecutor(max_workers=n)
+        futures = [_submit(pool, candidate) for _ in range(n)]
+        best, best_score = None, float("-inf")
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                text, score = future.result()
+                if text is not None and score > best_score:
+                    best, best_score = text, score
+                if threshold is not None and best_score >= threshold:
+                    break
+        finally:
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+        return best, best_score
+
+    def _generate_candidate(self, stop: threading.Event, early_exit: bool):
+        if not early_exit:
+            completion = self._create_completion(False, coalesce=False)
+            return self.provider.extract_response(completion)
+
+        # Streaming lets a losing candidate be dropped mid-generation.
+        completion = self._create_completion(True, coalesce=False)
+        chunks = self._iter_chunks(completion)
+        parts = []
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    return None
+                parts.append(chunk)
+        finally:
+            self._close_stream(chunks, completion)
+        return None if stop.is_set() else "".join(parts)
+
+    def _create_completion(
+        self,
+        stream: bool,
+        n: int = 1,
+        coalesce: bool = True,
+        prediction: Optional[str] = None,
+        continuation: Optional[str] = None,
+    ):
+        messages = self.messages.snapshot()
+        if continuation:
+            messages = messages + self.provider.continuation_messages(continuation)
         completion_params = {
             "stream": stream,
             "client": self.client,
             "model": self.model,
-            "messages": self.messages,
+            "messages": messages,
             "max_tokens": self.max_tokens,
             "temperature": self.temperature,
             "system": self.system,
             "reasoning_effort": self.reasoning_effort,
+            "tools": self.tools,
         }
-        return self.provider.create_completion(**completion_params)
+        if n > 1:
+            completion_params["n"] = n
+        if prediction:
+            completion_params["prediction"] = prediction
+        cache_points = self.messages.cache_points()
+        if cache_points:
+            completion_params["cache_points"] = cache_points
+        timeout = remaining_time()
+        if timeout is not None:
+            completion_params["timeout"] = timeout
+
+        try:
+            if self.coalesce and coalesce:
+                return self._coalesced_completion(completion_params)
+            return self._send(completion_params)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            # Report SDK timeouts caused by the deadline as the deadline itself.
+            if timeout is not None and _deadline.get() <= time.monotonic():
+                raise DeadlineExceeded("The deadline was exceeded.") from e
+            raise
+
+    def _send(self, completion_params: Dict[str, Any]):
+        def attempt() -> Dict[str, Any]:
+            # A retry only gets what is left of the deadline.
+            timeout = remaining_time()
+            if timeout is None:
+                return completion_params
+            return {**completion_params, "timeout": timeout}
+
+        if not self.key_pool:
+            if _deadline.get() is None:
+                return self.provider.create_completion(**completion_params)
+            # SDK retries are off under a deadline, so retry here within it.
+            return _with_retries(lambda: self.provider.create_completion(**attempt()))
+
+        stream = completion_params["stream"]
+
+        def request(key: str, release: Optional[Callable[..., None]] = None):
+            client = self.clients.get(self.provider, self.base_url, key)
+            if hasattr(client, "with_options"):
+                # Move a 429 to the next key instead of backing off on this one.
+                # Other transient errors are retried below.
+                client = client.with_options(max_retries=0)
+            completion = self.provider.create_completion(
+                **{**attempt(), "client": client}
+            )
+            return (
+                _LeasedStream(self.provider, completion, release)
+                if stream
+                else completion
+            )
+
+        return _with_retries(lambda: self.key_pool.call(request, hold=stream))
+
+    def _iter_chunks(self, completion: Any) -> Iterator[str]:
+        if isinstance(completion, (_SharedStream, _LeasedStream)):
+            return iter(completion)
+        return self.provider.iter_chunks(completion)
 
-    def _stream_response(self, completion):
+    def _request_key(self, completion_params: Dict[str, Any]) -> str:
+        request = {
+            k: v for k, v in completion_params.items() if k not in TRANSPORT_PARAMS
+        }
+        request["provider"] = type(self.provider).__name__
+        request["base_url"] = self.base_url
+        return _fingerprint(request)
+
+    def _coalesced_completion(self, completion_params: Dict[str, Any]):
+        key = self._request_key(completion_params)
+        with _in_flight_lock:
+            entry = _in_flight.get(key)
+            leader = entry is None
+            if leader:
+                entry = Future()
+                _in_flight[key] = entry
+
+        if not leader:
+            try:
+                return entry.result(timeout=completion_params.get("timeout"))
+            except concurrent.futures.TimeoutError:
+                raise DeadlineExceeded("The deadline was exceeded.") from None
+
+        try:
+            completion = self._send(completion_params)
+            if completion_params["stream"]:
+                completion = _SharedStream(
+                    self._iter_chunks(completion),
+                    lambda: _forget_in_flight(key, entry),
+                )
+        except BaseException as e:
+            _forget_in_flight(key, entry)
+            entry.set_exception(e)
+            raise
+
+        entry.set_result(completion)
+        if not completion_params["stream"]:
+            _forget_in_flight(key, entry)
+        return completion
+
+    def _stream_response(self, completion, expires: Optional[float] = None):
         full_response = []
-        for chunk in self.provider.iter_chunks(completion):
-            full_response.append(chunk)
-            yield chunk
+        resumes = 0
+        trim = False
+        while True:
+            chunks = self._iter_chunks(completion)
+            try:
+                for chunk in chunks:
+                    remaining_time(expires)
+                    if trim:
+                        # The whitespace before the cut was already sent.
+                        chunk = chunk.lstrip()
+                        trim = not chunk
+                        if not chunk:
+                            continue
+                    full_response.append(chunk)
+                    yield chunk
+                break
+            except DeadlineExceeded:
+                # Closing the upstream drops the connection and stops generation.
+                self._close_stream(chunks, completion)
+                raise
+            except Exception as e:
+                if resumes >= self.max_resumes or not _is_disconnect(e):
+                    raise
+                self._close_stream(chunks, completion)
+                resumes += 1
+                partial = "".join(full_response)
+                trim = partial[-1:].isspace()
+                completion = self._resume(partial, expires)
+
+        if isinstance(completion, _LeasedStream):
+            self.last_usage = self.provider.extract_usage(completion.completion)
+        elif not isinstance(completion, _SharedStream):
+            self.last_usage = self.provider.extract_usage(completion)
         full_response_str = "".join(full_response)
         self.messages.append({"role": "assistant", "content": full_response_str})
 
+    def _resume(self, partial: str, expires: Optional[float]):
+        """Reissue an interrupted stream so the model carries on from partial."""
+        # The consumer may iterate outside the caller's context, so restore
+        # the deadline the stream was started under.
+        token = _deadline.set(expires)
+        try:
+            return self._create_completion(
+                True, coalesce=False, continuation=partial if partial.strip() else None
+            )
+        finally:
+            _deadline.reset(token)
+
+    def _close_stream(self, chunks: Iterator[str], completion: Any) -> None:
+        for stream in (chunks, completion):
+            if hasattr(stream, "close"):
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_text(text: str, max_tokens: int = DEFAULT_CHUNK_TOKENS) -> List[str]:
+    """Split text into chunks of at most max_tokens, breaking at the coarsest boundary that fits.
+
+    Joining the chunks gives back the original text.
+    """
+    if max_tokens < 1:
+        raise ValueError("max_tokens must be at least 1.")
+    return _split_text(text, max_tokens, 0)
+
+
+def _split_text(text: str, max_tokens: int, level: int) -> List[str]:
+    if estimate_tokens(text) <= max_tokens:
+        return [text] if text else []
+    if level == len(SPLIT_BOUNDARIES):
+        # estimate_tokens adds a token to every text, so leave room for it.
+        size = max(1, (max_tokens - 1) * CHARS_PER_TOKEN)
+        return [text[i : i + size] for i in range(0, len(text), size)]
+
+    chunks = []
+    current = ""
+    for piece in SPLIT_BOUNDARIES[level].split(text):
+        if not piece:
+            continue
+        if estimate_tokens(current + piece) <= max_tokens:
+            current += piece
+            continue
+        if current:
+            chunks.append(current)
+        if estimate_tokens(piece) <= max_tokens:
+            current = piece
+        else:
+            chunks.extend(_split_text(piece, max_tokens, level + 1))
+            current = ""
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def map_reduce(
+    map_fn: Callable[..., Any],
+    *args: Any,
+    reduce_fn: Optional[Callable[[str], Any]] = None,
+    chunk_tokens: int = DEFAULT_CHUNK_TOKENS,
+    max_workers: int = DEFAULT_MAP_WORKERS,
+    separator: str = "\n\n",
+) -> ChatStream:
+    """Run map_fn over chunks of a long document concurrently and stream the results in order.
+
+    The document is the last positional argument, as in map_reduce(translate,
+    "spanish", text) for translate(lang, text). The first chunk streams while
+    later ones are still running. With reduce_fn, the joined map results are
+    passed to it and its output is streamed instead.
+    """
+    *fixed, document = args
+    chunks = split_text(document, chunk_tokens)
+    return ChatStream(
+        _map_reduce(map_fn, fixed, chunks, reduce_fn, max_workers, separator)
+    )
+
+
+def _map_reduce(
+    map_fn: Callable[..., Any],
+    fixed: List[Any],
+    chunks: List[str],
+    reduce_fn: Optional[Callable[[str], Any]],
+    max_workers: int,
+    separator: str,
+) -> Iterator[str]:
+    outputs = [queue.Queue() for _ in chunks]
+
+    def work(index: int, chunk: str) -> None:
+        # Prompts run on their own fork so chunks don't see each other.
+        target = map_fn.fork() if hasattr(map_fn, "fork") else map_fn
+        try:
+            result = target(*fixed, chunk)
+            for token in [result] if isinstance(result, str) else result:
+                outputs[index].put(token)
+            outputs[index].put(_StreamEnd())
+        except BaseException as e:
+            outputs[index].put(_StreamEnd(e))
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    for index, chunk in enumerate(chunks):
+        _submit(pool, work, index, chunk)
+
+    try:
+        results = []
+        for index, output in enumerate(outputs):
+            if index and reduce_fn is None:
+                yield separator
+            parts = []
+            while True:
+                item = output.get()
+                if isinstance(item, _StreamEnd):
+                    if item.error is not None:
+                        raise item.error
+                    break
+                parts.append(item)
+                if reduce_fn is None:
+                    yield item
+            results.append("".join(parts))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if reduce_fn is not None:
+        target = reduce_fn.fork() if hasattr(reduce_fn, "fork") else reduce_fn
+        result = target(separator.join(results))
+        yield from [result] if isinstance(result, str) else result
+
 
 def prompt(
     model,
@@ -295,33 +2039,1061 @@ def prompt(
     reasoning_effort=DEFAULT_REASONING_EFFORT,
     api_key=None,
     stream=False,
+    coalesce=False,
+    tools=None,
+    tool_timeout=None,
+    cassette=None,
+    best_of=None,
+    judge=None,
+    threshold=None,
+    accept=None,
+    timeout=None,
+    predict=None,
+    max_resumes=DEFAULT_MAX_RESUMES,
 ):
+    if best_of and isinstance(model, (list, tuple)):
+        raise ValueError(
+            "best_of can't be combined with a model cascade. Use one model, "
+            "or let the cascade's accept check pick the reply."
+        )
+
     def decorator(func):
         system_prompt = func.__doc__.strip() if func.__doc__ else ""
         chat_instance = None
+        lock = threading.Lock()
 
-        def wrapper(*args, **kwargs):
+        def get_chat():
             nonlocal chat_instance
-            if chat_instance is None:
-                chat_instance = Chat(
-                    model=model,
-                    system=system_prompt,
-                    max_tokens=max_tokens,
-                    temperature=temperature,
-                    reasoning_effort=reasoning_effort,
-                    provider=provider,
-                    base_url=base_url,
-                    api_key=api_key,
+            with lock:
+                if chat_instance is None and isinstance(model, (list, tuple)):
+                    chat_instance = Cascade(
+                        list(model),
+                        accept,
+                        system=system_prompt,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        reasoning_effort=reasoning_effort,
+                        provider=provider,
+                        base_url=base_url,
+                        api_key=api_key,
+                        coalesce=coalesce,
+                        tools=tools,
+                        tool_timeout=tool_timeout,
+                        cassette=cassette,
+                        max_resumes=max_resumes,
+                    )
+                elif chat_instance is None:
+                    chat_instance = Chat(
+                        model=model,
+                        system=system_prompt,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        reasoning_effort=reasoning_effort,
+                        provider=provider,
+                        base_url=base_url,
+                        api_key=api_key,
+                        coalesce=coalesce,
+                        tools=tools,
+                        tool_timeout=tool_timeout,
+                        cassette=cassette,
+                        max_resumes=max_resumes,
+                    )
+            return chat_instance
+
+        def respond(chat, *args, **kwargs):
+            if best_of:
+                winner = chat.best_of(func(*args, **kwargs), best_of, judge, threshold)
+                return ChatStream(iter([winner])) if stream else winner
+            if predict:
+                return chat(
+                    func(*args, **kwargs),
+                    stream=stream,
+                    prediction=predict(*args, **kwargs),
                 )
+            return chat(func(*args, **kwargs), stream=stream)
 
-            return chat_instance(func(*args, **kwargs), stream=stream)
+        def respond_within(chat, *args, **kwargs):
+            if timeout is None:
+                return respond(chat, *args, **kwargs)
+            with deadline(timeout):
+                return respond(chat, *args, **kwargs)
 
+        def wrapper(*args, **kwargs):
+            chat = get_chat()
+            # A shared history would make identical calls differ, so coalesced
+            # calls each run on their own fork of it.
+            return respond_within(chat.fork() if coalesce else chat, *args, **kwargs)
+
+        def fork():
+            branch = get_chat().fork()
+            return lambda *args, **kwargs: respond_within(branch, *args, **kwargs)
+
+        wrapper.fork = fork
+        wrapper.chat = get_chat
         return wrapper
 
     return decorator
 
 
+def model_judge(
+    model: str, criteria: str = DEFAULT_JUDGE_CRITERIA, **chat_kwargs: Any
+) -> Callable[[str, str], float]:
+    """Build a best_of judge that asks a (preferably cheap) model for a 0-10 score."""
+    clients = ClientCache()
+
+    def judge(user_message: str, candidate: str) -> float:
+        chat = Chat(
+            model,
+            system=JUDGE_SYSTEM_PROMPT.strip(),
+            temperature=0,
+            client_cache=clients,
+            **chat_kwargs,
+        )
+        reply = chat(
+            f"Criteria: {criteria}\n\n"
+            f"Request:\n{user_message}\n\n"
+            f"Response:\n{candidate}"
+        )
+        match = re.search(r"\d+(\.\d+)?", reply or "")
+        return float(match.group()) if match else 0.0
+
+    return judge
+
+
+def accept_json(schema: Optional[Dict[str, Any]] = None) -> Callable[[str, str], bool]:
+    """Build a cascade check that accepts replies parsing as JSON and matching schema.
+
+    Supports the type, enum, required, properties and items keywords.
+    """
+
+    def accept(user_message: str, response: str) -> bool:
+        text = re.sub(r"^```(?:json)?\s*|\s*```$", "", (response or "").strip())
+        try:
+            value = json.loads(text)
+        except ValueError:
+            return False
+        return schema is None or _matches_schema(value, schema)
+
+    return accept
+
+
+def _matches_schema(value: Any, schema: Dict[str, Any]) -> bool:
+    types = {
+        "object": dict,
+        "array": list,
+        "string": str,
+        "integer": int,
+        "number": (int, float),
+        "boolean": bool,
+        "null": type(None),
+    }
+    expected = schema.get("type")
+    if expected:
+        if isinstance(value, bool) and expected != "boolean":
+            return False
+        if not isinstance(value, types[expected]):
+            return False
+    if "enum" in schema and value not in schema["enum"]:
+        return False
+    if isinstance(value, dict):
+        if any(key not in value for key in schema.get("required", [])):
+            return False
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value and not _matches_schema(value[key], subschema):
+                return False
+    if isinstance(value, list) and "items" in schema:
+        return all(_matches_schema(item, schema["items"]) for item in value)
+    return True
+
+
+def accept_score(
+    judge: Callable[[str, str], float], threshold: float
+) -> Callable[[str, str], bool]:
+    """Build a cascade check from a best_of judge, such as model_judge()."""
+    return lambda user_message, response: judge(user_message, response) >= threshold
+
+
+class CascadeStats:
+    """Per-tier counters for a Cascade.
+
+    Latency saved by a tier compares the requests it served against the
+    average latency of the strongest tier, as if every request had gone there.
+    """
+
+    def __init__(self, models: List[str]):
+        self.models = models
+        self.requests = 0
+        self.escalations = 0
+        self.tiers = {
+            model: {
+                "calls": 0,
+                "accepted": 0,
+                "latency": 0.0,
+                "served": 0,
+                "spent": 0.0,
+            }
+            for model in models
+        }
+        self._lock = threading.Lock()
+
+    def record_call(self, model: str, latency: float, accepted: bool) -> None:
+        with self._lock:
+            tier = self.tiers[model]
+            tier["calls"] += 1
+            tier["accepted"] += accepted
+            tier["latency"] += latency
+
+    def record_request(self, model: str, spent: float) -> None:
+        with self._lock:
+            self.requests += 1
+            self.escalations += model != self.models[0]
+            self.tiers[model]["served"] += 1
+            self.tiers[model]["spent"] += spent
+
+    @property
+    def escalation_rate(self) -> float:
+        return self.escalations / self.requests if self.requests else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            top = self.tiers[self.models[-1]]
+            top_latency = top["latency"] / top["calls"] if top["calls"] else None
+            tiers = {}
+            for model, tier in self.tiers.items():
+                saved = None
+                if top_latency is not None:
+                    saved = tier["served"] * top_latency - tier["spent"]
+                tiers[model] = {
+                    "calls": tier["calls"],
+                    "accepted": tier["accepted"],
+                    "acceptance_rate": tier["accepted"] / tier["calls"]
+                    if tier["calls"]
+                    else 0.0,
+                    "avg_latency": tier["latency"] / tier["calls"]
+                    if tier["calls"]
+                    else None,
+                    "served": tier["served"],
+                    "latency_saved": saved,
+                }
+            return {
+                "requests": self.requests,
+                "escalation_rate": self.escalation_rate,
+                "tiers": tiers,
+            }
+
+
+class Cascade:
+    """A conversation answered by the cheapest model whose reply passes accept().
+
+    Each request goes to models[0] first and escalates tier by tier while
+    accept(user_message, response) fails. The strongest tier's reply is always
+    kept, so accept() isn't called for it. Only the kept reply is added to the
+    shared history.
+    """
+
+    def __init__(
+        self,
+        models: List[str],
+        accept: Callable[[str, str], bool],
+        system: str = "",
+        **chat_kwargs: Any,
+    ):
+        if accept is None:
+            raise ValueError(
+                "A cascade needs an accept check. Pass accept, for example "
+                "accept_json(schema) or accept_score(judge, threshold)."
+            )
+        self.models = models
+        self.accept = accept
+        self.tiers = [Chat(model, system=system, **chat_kwargs) for model in models]
+        self.messages = History()
+        self.stats = CascadeStats(models)
+
+    def __call__(
+        self, user_message: str, stream: bool = False, prediction: Optional[str] = None
+    ):
+        started = time.monotonic()
+        for model, tier in zip(self.models, self.tiers):
+            chat = tier.fork()
+            chat.messages = self.messages.fork()
+            call_started = time.monotonic()
+            response = chat(user_message, prediction=prediction)
+            accepted = tier is self.tiers[-1] or self.accept(user_message, response)
+            self.stats.record_call(model, time.monotonic() - call_started, accepted)
+            if accepted:
+                break
+
+        self.stats.record_request(model, time.monotonic() - started)
+        self.messages.append({"role": "user", "content": user_message})
+        self.messages.append({"role": "assistant", "content": response})
+        return ChatStream(iter([response])) if stream else response
+
+    def fork(self) -> "Cascade":
+        branch = copy.copy(self)
+        branch.messages = self.messages.fork()
+        return branch
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError(
+            "Embeddings and VectorIndex need NumPy. Install it with: pip install numpy"
+        ) from None
+    return numpy
+
+
+class Embedder:
+    """Turns texts into float32 vectors, batching requests up to the provider's limit."""
+
+    def __init__(
+        self,
+        model: str = DEFAULT_EMBEDDING_MODEL,
+        provider: Optional[str] = None,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        max_workers: int = DEFAULT_EMBED_WORKERS,
+        client_cache: Optional[ClientCache] = None,
+    ):
+        provider_info = self._get_provider_info(model, provider)
+        self.provider = provider_info["provider"]()
+        if client_cache:
+            self.client = client_cache.get(self.provider, base_url, api_key)
+        else:
+            self.client = self.provider.create_client(base_url, api_key)
+        self.model = provider_info.get("embedding_models", {}).get(model, model)
+        limit = self.provider.max_embed_batch
+        self.batch_size = min(batch_size or limit, limit)
+        self.max_workers = max_workers
+
+    def _get_provider_info(self, model: str, provider: Optional[str]) -> Dict[str, Any]:
+        if provider:
+            if provider not in Chat.PROVIDER_MAP:
+                raise ValueError(
+                    f"The provider '{provider}' is not supported. "
+                    "Check the available providers and try again."
+                )
+            return Chat.PROVIDER_MAP[provider]
+
+        for provider_info in Chat.PROVIDER_MAP.values():
+            models = provider_info.get("embedding_models", {})
+            if model in models.keys() or model in models.values():
+                return provider_info
+
+        raise ValueError(
+            f"The embedding model '{model}' isn't supported. "
+            "If you're using a custom model, specify a compatible provider and base_url."
+        )
+
+    def __call__(self, texts: List[str]):
+        """Embed texts into an (len(texts), dim) float32 matrix, in input order."""
+        np = _numpy()
+        if isinstance(texts, str):
+            raise TypeError("Embedder expects a list of texts.")
+        batches = [
+            texts[i : i + self.batch_size]
+            for i in range(0, len(texts), self.batch_size)
+        ]
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+        if len(batches) == 1:
+            vectors = self._embed_batch(batches[0])
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(batches))
+            ) as pool:
+                futures = [_submit(pool, self._embed_batch, batch) for batch in batches]
+                vectors = [vector for future in futures for vector in future.result()]
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        def embed() -> List[List[float]]:
+            return self.provider.embed(
+                texts, client=self.client, model=self.model, timeout=remaining_time()
+            )
+
+        # SDK retries are off under a deadline, so retry here within it.
+        return _with_retries(embed) if _deadline.get() is not None else embed()
+
+
+class VectorIndex:
+    """Cosine-similarity search over texts, kept as one contiguous float32 matrix.
+
+    Rows are normalized when added, so a search is a single matrix-vector
+    product followed by a partial sort. save() and load() persist the matrix
+    as .npy, which load() memory-maps by default.
+    """
+
+    def __init__(self, embedder: Optional[Embedder] = None):
+        self.embedder = embedder
+        self.texts: List[str] = []
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @property
+    def vectors(self):
+        if self._matrix is None:
+            np = _numpy()
+            return np.empty((0, 0), dtype=np.float32)
+        return self._matrix[: len(self.texts)]
+
+    def add(self, texts: List[str], vectors: Any = None) -> None:
+        if not texts:
+            return
+        np = _numpy()
+        if vectors is None:
+            if self.embedder is None:
+                raise ValueError("Pass vectors, or create the index with an embedder.")
+            vectors = self.embedder(texts)
+        vectors = self._normalize(
+            np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        )
+
+        with self._lock:
+            size = len(self.texts)
+            if self._matrix is not None and vectors.shape[1] != self._matrix.shape[1]:
+                raise ValueError(
+                    f"Expected {self._matrix.shape[1]}-dimensional vectors, "
+                    f"got {vectors.shape[1]}."
+                )
+            capacity = 0 if self._matrix is None else len(self._matrix)
+            if size + len(texts) > capacity:
+                # Grow geometrically so repeated adds stay amortized O(1) per row.
+                grown = np.empty(
+                    (max(size + len(texts), 2 * capacity), vectors.shape[1]),
+                    dtype=np.float32,
+                )
+                if size:
+                    grown[:size] = self._matrix[:size]
+                self._matrix = grown
+            self._matrix[size : size + len(texts)] = vectors
+            self.texts.extend(texts)
+
+    def search(self, query: Any, k: int = DEFAULT_TOP_K) -> List[Tuple[str, float]]:
+        """Return the k most similar (text, score) pairs, best first."""
+        return self.search_many([query], k)[0]
+
+    def search_many(
+        self, queries: List[Any], k: int = DEFAULT_TOP_K
+    ) -> List[List[Tuple[str, float]]]:
+        if not len(queries):
+            return []
+        np = _numpy()
+        with self._lock:
+            # Adds only append, so rows below size stay valid without the lock.
+            size = len(self.texts)
+            matrix = self.vectors
+        k = min(k, size)
+        if k <= 0:
+            return [[] for _ in queries]
+
+        if all(isinstance(query, str) for query in queries):
+            if self.embedder is None:
+                raise ValueError(
+                    "Pass query vectors, or create the index with an embedder."
+                )
+            queries = self.embedder(queries)
+        queries = self._normalize(
+            np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        )
+
+        scores = queries @ matrix.T
+        if k < size:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(size), scores.shape)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [
+            [(self.texts[i], float(score)) for i, score in zip(row, row_scores)]
+            for row, row_scores in zip(top.tolist(), top_scores.tolist())
+        ]
+
+    def save(self, path: str) -> None:
+        """Write path.npy with the vectors and path.json with the texts."""
+        np = _numpy()
+        with self._lock:
+            texts, matrix = list(self.texts), self.vectors
+        for suffix, write in (
+            (".npy", lambda file: np.save(file, matrix)),
+            (".json", lambda file: file.write(json.dumps(texts).encode("utf-8"))),
+        ):
+            tmp_path = f"{path}{suffix}.tmp"
+            with open(tmp_path, "wb") as file:
+                write(file)
+            os.replace(tmp_path, f"{path}{suffix}")
+
+    @classmethod
+    def load(
+        cls, path: str, embedder: Optional[Embedder] = None, mmap: bool = True
+    ) -> "VectorIndex":
+        np = _numpy()
+        index = cls(embedder)
+        with open(f"{path}.json", encoding="utf-8") as file:
+            index.texts = json.load(file)
+        index._matrix = np.load(f"{path}.npy", mmap_mode="r" if mmap else None)
+        if len(index._matrix) != len(index.texts):
+            raise ValueError(f"{path}.npy and {path}.json don't match.")
+        return index
+
+    def _normalize(self, vectors):
+        np = _numpy()
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return np.ascontiguousarray(vectors / norms, dtype=np.float32)
+
+
+class Gateway:
+    """An OpenAI-compatible HTTP endpoint in front of every model in Chat.PROVIDER_MAP.
+
+    All callers share the same SDK clients, in-flight request coalescing, an
+    optional response cache and optional per-provider rate limits.
+    """
+
+    def __init__(
+        self,
+        rate_limit: Optional[float] = None,
+        cache_size: int = 0,
+        max_concurrency: int = DEFAULT_GATEWAY_CONCURRENCY,
+    ):
+        self.clients = ClientCache()
+        self.cache = ResponseCache(cache_size)
+        self.limiters = {
+            name: RateLimiter(rate_limit) for name in Chat.PROVIDER_MAP if rate_limit
+        }
+        self.pool = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    async def serve(self, host: str, port: int, reuse_port: bool = False) -> None:
+        server = await asyncio.start_server(
+            self._handle, host, port, reuse_port=reuse_port or None
+        )
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                await self._route(method, path.split("?")[0], body, writer)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(
+        self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter
+    ) -> None:
+        if method == "GET" and path == "/v1/models":
+            models = [
+                {"id": model, "object": "model", "owned_by": provider_name}
+                for provider_name, info in Chat.PROVIDER_MAP.items()
+                for model in info["models"]
+            ]
+            await self._send_json(writer, 200, {"object": "list", "data": models})
+        elif method == "POST" and path == "/v1/chat/completions":
+            try:
+                request = json.loads(body)
+                chat, user_message = self._chat_for(request)
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                await self._send_error(writer, 400, str(e))
+                return
+            await self._complete(chat, user_message, request, writer)
+        else:
+            await self._send_error(writer, 404, f"No route for {method} {path}.")
+
+    def _chat_for(self, request: Dict[str, Any]):
+        messages = [
+            {**m, "content": self._text_content(m.get("content"))}
+            for m in request["messages"]
+        ]
+        if not messages or messages[-1]["role"] != "user":
+            raise ValueError("The last message must come from the user.")
+
+        chat = Chat(
+            model=request["model"],
+            system="\n".join(m["content"] for m in messages if m["role"] == "system"),
+            max_tokens=request.get("max_tokens")
+            or request.get("max_completion_tokens")
+            or DEFAULT_MAX_TOKENS,
+            temperature=request.get("temperature", DEFAULT_TEMPERATURE),
+            reasoning_effort=request.get("reasoning_effort", DEFAULT_REASONING_EFFORT),
+            coalesce=True,
+            client_cache=self.clients,
+        )
+        chat.messages = [m for m in messages[:-1] if m["role"] != "system"]
+        return chat, messages[-1]["content"]
+
+    def _text_content(self, content: Any) -> str:
+        # OpenAI clients may send content as a list of parts.
+        if content is None or isinstance(content, str):
+            return content or ""
+        if not isinstance(content, list):
+            raise TypeError("Message content must be a string or a list of parts.")
+        if any(
+            not isinstance(part, dict) or part.get("type") != "text" for part in content
+        ):
+            raise ValueError("Only text content parts are supported.")
+        return "".join(part["text"] for part in content)
+
+    def _provider_name(self, chat: Chat) -> Optional[str]:
+        for name, info in Chat.PROVIDER_MAP.items():
+            if isinstance(chat.provider, info["provider"]):
+                return name
+        return None
+
+    async def _complete(
+        self,
+        chat: Chat,
+        user_message: str,
+        request: Dict[str, Any],
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        stream = bool(request.get("stream"))
+        key = _fingerprint({k: v for k, v in request.items() if k != "stream"})
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        response = self.cache.get(key)
+        if response is None:
+            limiter = self.limiters.get(self._provider_name(chat))
+            if limiter:
+                await asyncio.sleep(limiter.reserve())
+            try:
+                chunks = await loop.run_in_executor(
+                    self.pool, chat, user_message, stream
+                )
+            except Exception as e:
+                await self._send_error(writer, 502, str(e))
+                return
+        else:
+            chunks = iter([response])
+
+        if not stream:
+            if response is None:
+                response = chunks
+                self.cache.put(key, response)
+            await self._send_json(
+                writer,
+                200,
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": response},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                },
+            )
+            return
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+
+        def event(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> Dict:
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+
+        parts = []
+        try:
+            iterator = iter(chunks)
+            while True:
+                chunk = await loop.run_in_executor(self.pool, next, iterator, None)
+                if chunk is None:
+                    break
+                parts.append(chunk)
+                await self._send_event(
+                    writer, event({"role": "assistant", "content": chunk})
+                )
+            await self._send_event(writer, event({}, "stop"))
+            if response is None:
+                self.cache.put(key, "".join(parts))
+        except Exception as e:
+            await self._send_event(writer, {"error": {"message": str(e)}})
+        await self._send_event(writer, "[DONE]")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _send_event(self, writer: asyncio.StreamWriter, payload: Any) -> None:
+        data = payload if isinstance(payload, str) else json.dumps(payload)
+        encoded = f"data: {data}\n\n".encode("utf-8")
+        writer.write(f"{len(encoded):x}\r\n".encode("ascii") + encoded + b"\r\n")
+        await writer.drain()
+
+    async def _send_json(
+        self, writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any]
+    ) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found"}.get(status, "Error")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode("ascii")
+            + body
+        )
+        await writer.drain()
+
+    async def _send_error(
+        self, writer: asyncio.StreamWriter, status: int, message: str
+    ) -> None:
+        await self._send_json(
+            writer, status, {"error": {"message": message, "type": "gateway_error"}}
+        )
+
+
+def serve(
+    host: str = DEFAULT_GATEWAY_HOST,
+    port: int = DEFAULT_GATEWAY_PORT,
+    workers: int = 1,
+    rate_limit: Optional[float] = None,
+    cache_size: int = 0,
+    max_concurrency: int = DEFAULT_GATEWAY_CONCURRENCY,
+) -> None:
+    if workers > 1:
+        # Each worker binds the same port with SO_REUSEPORT and the kernel
+        # spreads connections between them, so the rate limit is split too.
+        processes = [
+            multiprocessing.Process(
+                target=_serve_worker,
+                args=(host, port, rate_limit and rate_limit / workers),
+                kwargs={"cache_size": cache_size, "max_concurrency": max_concurrency},
+            )
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    else:
+        _serve_worker(host, port, rate_limit, cache_size, max_concurrency, False)
+
+
+def _serve_worker(
+    host: str,
+    port: int,
+    rate_limit: Optional[float],
+    cache_size: int = 0,
+    max_concurrency: int = DEFAULT_GATEWAY_CONCURRENCY,
+    reuse_port: bool = True,
+) -> None:
+    gateway = Gateway(rate_limit, cache_size, max_concurrency)
+    try:
+        asyncio.run(gateway.serve(host, port, reuse_port))
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="chat.py serve",
+        description="OpenAI-compatible gateway for every supported model",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s
+  %(prog)s --port 8080 --workers 4
+  %(prog)s --rate-limit 5 --cache-size 1000
+        """.strip(),
+    )
+    parser.add_argument(
+        "--host",
+        default=DEFAULT_GATEWAY_HOST,
+        help=f"Host to bind (default: {DEFAULT_GATEWAY_HOST})",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=DEFAULT_GATEWAY_PORT,
+        help=f"Port to bind (default: {DEFAULT_GATEWAY_PORT})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes sharing the port (default: 1)",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        help="Requests per second allowed per provider, across all workers",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=0,
+        help="Responses kept in the LRU cache (default: 0, disabled)",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=DEFAULT_GATEWAY_CONCURRENCY,
+        help=f"Upstream requests in flight per worker (default: {DEFAULT_GATEWAY_CONCURRENCY})",
+    )
+
+    args = parser.parse_args(argv)
+    print(f"🚀 Serving on http://{args.host}:{args.port}/v1 ({args.workers} worker(s))")
+    serve(
+        args.host,
+        args.port,
+        args.workers,
+        args.rate_limit,
+        args.cache_size,
+        args.max_concurrency,
+    )
+
+
+class _InvalidParams(ValueError):
+    pass
+
+
+class StdioServer:
+    """A JSON-RPC 2.0 co-process speaking newline-delimited JSON on stdin and stdout.
+
+    Sessions run concurrently. Each session has its own queue and handles its
+    requests in the order they arrived, keeping its Chat history and SDK
+    clients warm between requests:
+
+      session.new     {"model", "system", "provider", ...}  -> {"session": id}
+      session.send    {"session", "message", "timeout"?}    -> {"response": text}
+      session.stream  {"session", "message", "timeout"?}    -> {"response": text}
+                      after "session.chunk" notifications {"session", "id", "chunk"}
+      session.close   {"session"}                           -> {"closed": true}
+    """
+
+    PARSE_ERROR = -32700
+    INVALID_REQUEST = -32600
+    METHOD_NOT_FOUND = -32601
+    INVALID_PARAMS = -32602
+    SERVER_ERROR = -32000
+    SESSION_PARAMS = (
+        "system",
+        "provider",
+        "base_url",
+        "api_key",
+        "max_tokens",
+        "temperature",
+        "reasoning_effort",
+    )
+
+    def __init__(
+        self,
+        input: Any = None,
+        output: Any = None,
+        max_workers: int = DEFAULT_STDIO_WORKERS,
+    ):
+        self.input = input or sys.stdin
+        self.output = output or sys.stdout
+        # Runs session.new and requests for unknown sessions. Session requests
+        # go to the session's own single-worker queue.
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.clients = ClientCache()
+        self.sessions: Dict[str, Tuple[Chat, ThreadPoolExecutor]] = {}
+        self._queues: List[ThreadPoolExecutor] = []
+        self._sessions_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.methods = {
+            "session.new": self._new,
+            "session.send": self._send,
+            "session.stream": self._stream,
+            "session.close": self._close,
+        }
+
+    def run(self) -> None:
+        """Serve requests until stdin closes, then finish the ones in flight."""
+        for line in self.input:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                self._error(None, self.PARSE_ERROR, f"Parse error: {e}")
+                continue
+            if not isinstance(request, dict) or not isinstance(
+                request.get("method"), str
+            ):
+                self._error(None, self.INVALID_REQUEST, "Invalid request")
+                continue
+            self._dispatch(request)
+
+        self.pool.shutdown(wait=True)
+        with self._sessions_lock:
+            queues = list(self._queues)
+        for session_queue in queues:
+            session_queue.shutdown(wait=True)
+
+    def _dispatch(self, request: Dict[str, Any]) -> None:
+        # Requests are queued from this one reader thread, so each session's
+        # queue sees them in arrival order.
+        params = request.get("params")
+        session = params.get("session") if isinstance(params, dict) else None
+        closing = request["method"] == "session.close"
+        with self._sessions_lock:
+            entry = self.sessions.get(session) if isinstance(session, str) else None
+            if entry and closing:
+                del self.sessions[session]
+
+        if entry is None:
+            self.pool.submit(self._handle, request, None)
+            return
+        chat, session_queue = entry
+        session_queue.submit(self._handle, request, chat)
+        if closing:
+            # Requests already queued still run; later ones find no session.
+            session_queue.shutdown(wait=False)
+
+    def _handle(self, request: Dict[str, Any], chat: Optional[Chat]) -> None:
+        request_id = request.get("id")
+        handler = self.methods.get(request["method"])
+        if handler is None:
+            self._error(
+                request_id,
+                self.METHOD_NOT_FOUND,
+                f"Method not found: {request['method']}",
+            )
+            return
+
+        params = request.get("params") or {}
+        try:
+            if not isinstance(params, dict):
+                raise _InvalidParams("Params must be an object")
+            result = handler(params, request_id, chat)
+        except _InvalidParams as e:
+            self._error(request_id, self.INVALID_PARAMS, str(e))
+            return
+        except Exception as e:
+            self._error(
+                request_id, self.SERVER_ERROR, str(e), {"type": type(e).__name__}
+            )
+            return
+        if request_id is not None:
+            self._write({"jsonrpc": "2.0", "id": request_id, "result": result})
+
+    def _new(
+        self, params: Dict[str, Any], request_id: Any, chat: Optional[Chat]
+    ) -> Dict[str, Any]:
+        options = {k: params[k] for k in self.SESSION_PARAMS if k in params}
+        chat = Chat(self._param(params, "model"), client_cache=self.clients, **options)
+        session = uuid.uuid4().hex
+        session_queue = ThreadPoolExecutor(max_workers=1)
+        with self._sessions_lock:
+            self.sessions[session] = (chat, session_queue)
+            self._queues.append(session_queue)
+        return {"session": session}
+
+    def _send(
+        self, params: Dict[str, Any], request_id: Any, chat: Optional[Chat]
+    ) -> Dict[str, Any]:
+        message = self._param(params, "message")
+        chat = self._session(params, chat)
+        with self._deadline(params):
+            return {"response": chat(message)}
+
+    def _stream(
+        self, params: Dict[str, Any], request_id: Any, chat: Optional[Chat]
+    ) -> Dict[str, Any]:
+        message = self._param(params, "message")
+        chat = self._session(params, chat)
+        chunks = []
+        with self._deadline(params):
+            for chunk in chat(message, stream=True):
+                chunks.append(chunk)
+                self._write(
+                    {
+                        "jsonrpc": "2.0",
+                        "method": "session.chunk",
+                        "params": {
+                            "session": params["session"],
+                            "id": request_id,
+                            "chunk": chunk,
+                        },
+                    }
+                )
+        return {"response": "".join(chunks)}
+
+    def _close(
+        self, params: Dict[str, Any], request_id: Any, chat: Optional[Chat]
+    ) -> Dict[str, Any]:
+        self._param(params, "session")
+        return {"closed": chat is not None}
+
+    def _param(self, params: Dict[str, Any], name: str) -> Any:
+        if name not in params:
+            raise _InvalidParams(f"Missing param: {name}")
+        return params[name]
+
+    def _session(self, params: Dict[str, Any], chat: Optional[Chat]) -> Chat:
+        session = self._param(params, "session")
+        if chat is None:
+            raise ValueError(f"Unknown session: {session}")
+        return chat
+
+    @contextmanager
+    def _deadline(self, params: Dict[str, Any]):
+        if params.get("timeout") is None:
+            yield
+            return
+        with deadline(params["timeout"]):
+            yield
+
+    def _error(
+        self, request_id: Any, code: int, message: str, data: Any = None
+    ) -> None:
+        error = {"code": code, "message": message}
+        if data is not None:
+            error["data"] = data
+        self._write({"jsonrpc": "2.0", "id": request_id, "error": error})
+
+    def _write(self, payload: Dict[str, Any]) -> None:
+        line = json.dumps(payload, ensure_ascii=False)
+        with self._write_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+
 def main():
+    if sys.argv[1:2] == ["serve"]:
+        serve_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
         description="AI Chat",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -331,6 +3103,8 @@ Examples:
   %(prog)s "Explain quantum computing" -m gpt4.1 sonnet4
   %(prog)s "Write a poem" --system "You are a creative poet"
   %(prog)s "Solve this math problem" --temperature 0.2 --max-tokens 1000 --no-stream
+  %(prog)s serve --port 8000 --workers 4
+  %(prog)s --stdio
         """.strip(),
     )
 
@@ -369,9 +3143,18 @@ Examples:
         choices=["low", "medium", "high"],
         help=f"Reasoning effort for reasoning models (default: {DEFAULT_REASONING_EFFORT})",
     )
+    parser.add_argument(
+        "--stdio",
+        action="store_true",
+        help="Run as a JSON-RPC co-process reading requests from stdin",
+    )
 
     args = parser.parse_args()
 
+    if args.stdio:
+        StdioServer().run()
+        return
+
     if not args.message:
         parser.print_help()
         return
@@ -1,8 +1,8 @@
 import asyncio
-import concurrent.futures
+import functools
 import os
 
-from src.chat import prompt
+from src.chat import FileSink, deadline, map_reduce, prompt
 
 
 cloud = {"stream": True}
@@ -105,33 +105,26 @@ def gemini(lang, text):
     return _get_translation_prompt(lang, text)
 
 
-def stream(prompt_function, *args):
+def stream(prompt_function, *args, filename=None):
+    """Print tokens as they arrive and write them to filename progressively."""
     print("\n")
     print("─" * 80)
-    response = ""
-    for token in prompt_function(*args):
-        print(token, end="", flush=True)
-        response += token
+    sinks = [lambda token: print(token, end="", flush=True)]
+    if filename:
+        sinks.append(FileSink(filename))
+    response = prompt_function(*args).multicast(*sinks)
     print("\n" + "─" * 80 + "\n")
     return response
 
 
-def dump(data: str, filename: str) -> bool:
-    """Write data to a file with error handling."""
-    try:
-        with open(filename, "w", encoding="utf-8") as file:
-            file.write(data)
-        return True
-    except IOError as e:
-        print(f"Error writing to {filename}: {e}")
-        return False
+async def async_stream(prompt_function, *args, filename=None):
+    """Execute stream function in a separate thread to allow concurrent execution."""
+    # to_thread carries context variables, so the pipeline deadline applies too.
+    return await asyncio.to_thread(stream, prompt_function, *args, filename=filename)
 
 
-async def async_stream(prompt_function, *args):
-    """Execute stream function in a separate thread to allow concurrent execution."""
-    loop = asyncio.get_event_loop()
-    with concurrent.futures.ThreadPoolExecutor() as pool:
-        return await loop.run_in_executor(pool, stream, prompt_function, *args)
+# The whole pipeline must finish within this budget
+PIPELINE_TIMEOUT = 15 * 60
 
 
 async def main():
@@ -140,33 +133,43 @@ async def main():
     os.makedirs("fun", exist_ok=True)
 
     # Generate world rules
-    rules = stream(define_system_rules)
-    dump(rules, "fun/rules.md")
+    rules = stream(define_system_rules, filename="fun/rules.md")
 
     # Async generation of characters and abilities
     characters, abilities = await asyncio.gather(
-        async_stream(create_character_profiles, rules),
-        async_stream(define_character_abilities, rules),
+        async_stream(create_character_profiles, rules, filename="fun/characters.md"),
+        async_stream(define_character_abilities, rules, filename="fun/abilities.md"),
     )
-    dump(characters, "fun/characters.md")
-    dump(abilities, "fun/abilities.md")
 
     # Create interactions and translations
-    interactions = stream(create_character_interactions, characters, abilities)
-    dump(interactions, "fun/interactions.md")
+    interactions = stream(
+        create_character_interactions,
+        characters,
+        abilities,
+        filename="fun/interactions.md",
+    )
 
-    # Async generation of translations
+    # Async generation of translations, each split into concurrent chunks
+    translators = [
+        (sonnet, "fun/sonnet.md"),
+        (gpt4o, "fun/gpt4o.md"),
+        (gemini, "fun/gemini.md"),
+    ]
     sonnets, gpt4os, geminis = await asyncio.gather(
-        async_stream(sonnet, "spanish", interactions),
-        async_stream(gpt4o, "spanish", interactions),
-        async_stream(gemini, "spanish", interactions),
+        *(
+            async_stream(
+                functools.partial(map_reduce, translator),
+                "spanish",
+                interactions,
+                filename=filename,
+            )
+            for translator, filename in translators
+        )
     )
-    dump(sonnets, "fun/sonnet.md")
-    dump(gpt4os, "fun/gpt4o.md")
-    dump(geminis, "fun/gemini.md")
 
     return rules, characters, abilities, interactions, sonnets, gpt4os, geminis
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    with deadline(PIPELINE_TIMEOUT):
+        asyncio.run(main())
@@ -1,214 +1,371 @@
 import argparse
+import io
+import json
 import os
 import sys
+import threading
 import time
-from typing import Dict, List, Optional, Tuple
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
-from chat import Chat, prompt
+from chat import Cassette, Chat, RateLimiter, prompt
 
 
-def test_model(chat: Chat, model_name: str, verbose: bool = False) -> bool:
-    if verbose:
-        print(f"\n{'=' * 50}")
-        print(f"Testing {model_name}")
-        print("=" * 50)
-    else:
-        print(f"\nTesting {model_name}:")
-
-    try:
-        print("→ Normal response test:" if verbose else "Normal response:")
-        response = chat("What color is the sky?")
-        print(response)
+CHAT_MODES = ["normal", "streaming"]
+DECORATOR_MODES = ["decorator", "decorator-streaming"]
+DEFAULT_RATE_LIMIT = 2.0
+DEFAULT_CONCURRENCY = 1
+STAND_IN_LATENCY = 0.05
+COALESCE_CALLERS = 20
 
-        print("\n→ Streaming response test:" if verbose else "\nStreaming response:")
-        for chunk in chat("What color is grass?", stream=True):
-            print(chunk, end="", flush=True)
-        print("\n")
 
-        if verbose:
-            print(f"✅ {model_name} - All tests passed")
+class TestJob(NamedTuple):
+    label: str
+    model: str
+    group: str
+    provider: Optional[str] = None
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
 
-        return True
 
-    except Exception as e:
-        print(f"❌ {model_name} - Error: {str(e)}")
-        return False
+def timed_call(mode: str, call) -> Dict[str, Any]:
+    started = time.monotonic()
+    response = call()
+    latency = time.monotonic() - started
+    return {"mode": mode, "latency": latency, "ttft": latency, "response": response}
 
 
-def test_decorator(
-    model: str,
-    provider: Optional[str] = None,
-    base_url: Optional[str] = None,
-    verbose: bool = False,
-) -> bool:
-    if verbose:
-        print(f"\n→ Testing @prompt decorator for {model}")
+def timed_stream(mode: str, call) -> Dict[str, Any]:
+    started = time.monotonic()
+    ttft = None
+    chunks = []
+    for chunk in call():
+        if ttft is None:
+            ttft = time.monotonic() - started
+        chunks.append(chunk)
+    latency = time.monotonic() - started
+    return {"mode": mode, "latency": latency, "ttft": ttft, "response": "".join(chunks)}
 
-    try:
-        decorator_kwargs = {
-            "model": model,
-            "provider": provider,
-            "base_url": base_url,
-            "max_tokens": 2048,
-            "temperature": 1,
-            "reasoning_effort": "low",
-        }
 
-        @prompt(**decorator_kwargs)
-        def simple_question():
-            """Provide concise and accurate responses."""
-            return "What color is the sun?"
+def test_model(chat: Chat, limiter: RateLimiter) -> List[Dict[str, Any]]:
+    limiter.acquire()
+    normal = timed_call("normal", lambda: chat("What color is the sky?"))
 
-        @prompt(**decorator_kwargs, stream=True)
-        def simple_question_stream():
-            """Provide concise and accurate responses."""
-            return "What color is the moon?"
+    limiter.acquire()
+    streaming = timed_stream(
+        "streaming", lambda: chat("What color is grass?", stream=True)
+    )
 
-        print(f"\n@prompt decorator - {model} normal response:")
-        print(simple_question())
+    return [normal, streaming]
 
-        print(f"\n@prompt decorator - {model} streaming response:")
-        for chunk in simple_question_stream():
-            print(chunk, end="", flush=True)
-        print("\n")
 
-        return True
+def test_decorator(
+    job: TestJob, limiter: RateLimiter, cassette: Optional[Cassette] = None
+) -> List[Dict[str, Any]]:
+    decorator_kwargs = {
+        "model": job.model,
+        "provider": job.provider,
+        "base_url": job.base_url,
+        "api_key": job.api_key,
+        "max_tokens": 2048,
+        "temperature": 1,
+        "reasoning_effort": "low",
+        "cassette": cassette,
+    }
 
-    except Exception as e:
-        print(f"❌ @prompt decorator for {model} - Error: {str(e)}")
-        return False
+    @prompt(**decorator_kwargs)
+    def simple_question():
+        """Provide concise and accurate responses."""
+        return "What color is the sun?"
 
+    @prompt(**decorator_kwargs, stream=True)
+    def simple_question_stream():
+        """Provide concise and accurate responses."""
+        return "What color is the moon?"
 
-def get_models_by_provider(provider_name: str) -> List[str]:
-    return list(Chat.PROVIDER_MAP.get(provider_name, {}).get("models", {}).keys())
+    limiter.acquire()
+    normal = timed_call("decorator", simple_question)
 
+    limiter.acquire()
+    streaming = timed_stream("decorator-streaming", simple_question_stream)
 
-def create_chat_instance(
-    model: str,
-    system_prompt: str,
-    provider: Optional[str] = None,
-    base_url: Optional[str] = None,
-    api_key: Optional[str] = None,
-) -> Chat:
-    kwargs = {"model": model, "system": system_prompt}
-    if provider:
-        kwargs["provider"] = provider
-    if base_url:
-        kwargs["base_url"] = base_url
-    if api_key:
-        kwargs["api_key"] = api_key
-    return Chat(**kwargs)
+    return [normal, streaming]
 
 
-def test_provider_models(
-    provider_name: str,
-    system_prompt: str,
-    api_keys: Dict[str, str],
-    test_decorators: bool = False,
-    verbose: bool = False,
-) -> Tuple[int, int]:
-    models = get_models_by_provider(provider_name)
-    if not models:
-        print(f"❌ Unknown provider: {provider_name}")
-        return 0, 0
+def test_coalescing(base_url: str) -> Dict[str, Any]:
+    """Check that concurrent identical @prompt calls share one stand-in request."""
 
-    api_key_name = f"{provider_name.upper()}_API_KEY"
-    api_key = api_keys.get(api_key_name)
-    if not api_key:
-        print(
-            f"⚠️  Warning: No API key found for {provider_name}. Set {api_key_name} environment variable."
+    @prompt(
+        model="stand-in",
+        provider="openai",
+        base_url=base_url,
+        api_key="offline",
+        coalesce=True,
+    )
+    def summarize(text):
+        """Summarize the text in one sentence."""
+        return text
+
+    before = StandInHandler.requests
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=COALESCE_CALLERS) as pool:
+        responses = list(
+            pool.map(lambda _: summarize("same text"), range(COALESCE_CALLERS))
         )
+    latency = time.monotonic() - started
+    upstream = StandInHandler.requests - before
+
+    error = None
+    if upstream != 1:
+        error = f"{COALESCE_CALLERS} calls made {upstream} upstream requests"
+    elif len(set(responses)) != 1:
+        error = "callers got different replies"
+    return {
+        "mode": "decorator-coalesced",
+        "latency": latency,
+        "ttft": latency,
+        "response": responses[0],
+        "passed": error is None,
+        "error": error,
+        "model": "Coalescing",
+        "provider": "offline",
+    }
 
-    passed = 0
-    total = len(models)
-
-    for model in models:
-        try:
-            chat = create_chat_instance(
-                model, system_prompt, provider_name, api_key=api_key
-            )
-
-            if test_model(chat, f"{provider_name.title()} {model}", verbose):
-                passed += 1
-
-            if test_decorators:
-                test_decorator(model, provider=provider_name, verbose=verbose)
-
-        except Exception as e:
-            print(f"❌ Failed to initialize {provider_name} {model}: {str(e)}")
 
-        time.sleep(1)
+def format_result(result: Dict[str, Any], verbose: bool = False) -> str:
+    if not result["passed"]:
+        return f"❌ {result['mode']:<20} Error: {result['error'] or 'empty response'}"
 
-    return passed, total
+    line = (
+        f"✅ {result['mode']:<20} "
+        f"latency {result['latency']:.2f}s  ttft {result['ttft']:.2f}s"
+    )
+    if verbose:
+        line += f"\n{result['response']}\n"
+    return line
 
 
-def test_local_models(
-    base_url: str,
-    models: List[str],
+def run_job(
+    job: TestJob,
+    modes: List[str],
     system_prompt: str,
-    test_decorators: bool = False,
+    limiter: RateLimiter,
+    cassette: Optional[Cassette] = None,
     verbose: bool = False,
-) -> Tuple[int, int]:
-    passed = 0
-    total = len(models)
+) -> Tuple[List[Dict[str, Any]], str]:
+    """Test one model in every mode, buffering the output so jobs don't interleave."""
+    out = io.StringIO()
+    print(f"\n{'=' * 50}\nTesting {job.label}\n{'=' * 50}", file=out)
+
+    suites = []
+    if any(mode in CHAT_MODES for mode in modes):
+        suites.append(
+            (
+                CHAT_MODES,
+                lambda: test_model(
+                    create_chat_instance(job, system_prompt, cassette), limiter
+                ),
+            )
+        )
+    if any(mode in DECORATOR_MODES for mode in modes):
+        suites.append((DECORATOR_MODES, lambda: test_decorator(job, limiter, cassette)))
 
-    for model in models:
+    results = []
+    for suite_modes, run in suites:
         try:
-            chat = create_chat_instance(model, system_prompt, "openai", base_url)
+            suite_results = [
+                {**result, "passed": bool(result["response"]), "error": None}
+                for result in run()
+            ]
+        except Exception as e:
+            suite_results = [
+                {
+                    "mode": mode,
+                    "latency": None,
+                    "ttft": None,
+                    "response": None,
+                    "passed": False,
+                    "error": str(e),
+                }
+                for mode in suite_modes
+            ]
+
+        for result in suite_results:
+            result.update({"model": job.label, "provider": job.group})
+            results.append(result)
+            print(format_result(result, verbose), file=out)
+
+    return results, out.getvalue()
+
+
+def run_tests(
+    jobs: List[TestJob],
+    modes: List[str],
+    system_prompt: str,
+    rate_limit: float = DEFAULT_RATE_LIMIT,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    cassette: Optional[Cassette] = None,
+    verbose: bool = False,
+) -> List[Dict[str, Any]]:
+    """Test every provider at once, each within its own rate limit."""
+    groups: Dict[str, List[TestJob]] = {}
+    for job in jobs:
+        groups.setdefault(job.group, []).append(job)
+    print_lock = threading.Lock()
+
+    def run_group(group: str) -> List[Dict[str, Any]]:
+        limiter = RateLimiter(rate_limit)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(
+                    run_job, job, modes, system_prompt, limiter, cassette, verbose
+                )
+                for job in groups[group]
+            ]
+            results = []
+            for future in futures:
+                job_results, output = future.result()
+                with print_lock:
+                    print(output, end="", flush=True)
+                results.extend(job_results)
+            return results
 
-            if test_model(chat, f"Local {model}", verbose):
-                passed += 1
+    with ThreadPoolExecutor(max_workers=max(1, len(groups))) as pool:
+        return [result for results in pool.map(run_group, groups) for result in results]
 
-            if test_decorators:
-                test_decorator(
-                    model, provider="openai", base_url=base_url, verbose=verbose
-                )
 
-        except Exception as e:
-            print(f"❌ Failed to test local model {model}: {str(e)}")
+def get_models_by_provider(provider_name: str) -> List[str]:
+    return list(Chat.PROVIDER_MAP.get(provider_name, {}).get("models", {}).keys())
 
-        time.sleep(1)
 
-    return passed, total
+def get_provider_of(model: str) -> str:
+    for provider_name, info in Chat.PROVIDER_MAP.items():
+        if model in info["models"] or model in info["models"].values():
+            return provider_name
+    return "unknown"
 
 
-def test_specific_models(
-    models: List[str],
-    system_prompt: str,
-    is_local: bool = False,
-    base_url: Optional[str] = None,
-    test_decorators: bool = False,
-    verbose: bool = False,
-) -> Tuple[int, int]:
-    passed = 0
-    total = len(models)
+def create_chat_instance(
+    job: TestJob, system_prompt: str, cassette: Optional[Cassette] = None
+) -> Chat:
+    kwargs = {"model": job.model, "system": system_prompt, "cassette": cassette}
+    if job.provider:
+        kwargs["provider"] = job.provider
+    if job.base_url:
+        kwargs["base_url"] = job.base_url
+    if job.api_key:
+        kwargs["api_key"] = job.api_key
+    return Chat(**kwargs)
 
-    for model in models:
-        try:
-            if is_local:
-                chat = create_chat_instance(model, system_prompt, "openai", base_url)
-                model_name = f"Local {model}"
-            else:
-                chat = create_chat_instance(model, system_prompt)
-                model_name = model
-
-            if test_model(chat, model_name, verbose):
-                passed += 1
-
-            if test_decorators:
-                if is_local:
-                    test_decorator(
-                        model, provider="openai", base_url=base_url, verbose=verbose
-                    )
-                else:
-                    test_decorator(model, verbose=verbose)
 
-        except Exception as e:
-            print(f"❌ Failed to test model {model}: {str(e)}")
+def provider_jobs(
+    provider_name: str, api_keys: Dict[str, str], warn: bool = True
+) -> List[TestJob]:
+    models = get_models_by_provider(provider_name)
+    if not models:
+        print(f"❌ Unknown provider: {provider_name}")
+        return []
 
-        time.sleep(1)
+    api_key_name = f"{provider_name.upper()}_API_KEY"
+    api_key = api_keys.get(api_key_name)
+    if not api_key and warn:
+        print(
+            f"⚠️  Warning: No API key found for {provider_name}. Set {api_key_name} environment variable."
+        )
 
-    return passed, total
+    return [
+        TestJob(
+            f"{provider_name.title()} {model}",
+            model,
+            provider_name,
+            provider_name,
+            api_key=api_key,
+        )
+        for model in models
+    ]
+
+
+def local_jobs(models: List[str], base_url: str) -> List[TestJob]:
+    return [
+        TestJob(f"Local {model}", model, "local", "openai", base_url)
+        for model in models
+    ]
+
+
+def specific_jobs(models: List[str]) -> List[TestJob]:
+    return [TestJob(model, model, get_provider_of(model)) for model in models]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """A tiny OpenAI-compatible endpoint that answers every chat with a canned reply."""
+
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        with self.lock:
+            StandInHandler.requests += 1
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length))
+        model = request.get("model", "")
+        reply = f"The stand-in for {model} says the answer is blue."
+        time.sleep(STAND_IN_LATENCY)
+
+        if not request.get("stream"):
+            self._send_json(
+                {
+                    "id": "chatcmpl-stand-in",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": reply},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                }
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for word in reply.split(" "):
+            chunk = {
+                "id": "chatcmpl-stand-in",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word + " "}}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(STAND_IN_LATENCY / 5)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def _send_json(self, payload: Dict[str, Any]):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in() -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/v1"
 
 
 def get_api_keys() -> Dict[str, str]:
@@ -219,12 +376,21 @@ def get_api_keys() -> Dict[str, str]:
     }
 
 
-def print_summary(total_passed: int, total_tests: int) -> None:
+def count_passed(results: List[Dict[str, Any]]) -> Tuple[int, int]:
+    models: Dict[str, bool] = {}
+    for result in results:
+        models[result["model"]] = models.get(result["model"], True) and result["passed"]
+    return sum(models.values()), len(models)
+
+
+def print_summary(results: List[Dict[str, Any]], elapsed: float) -> None:
+    total_passed, total_tests = count_passed(results)
     print(f"\n{'=' * 50}")
     print(f"📊 Test Summary: {total_passed}/{total_tests} models passed")
     if total_tests > 0:
         success_rate = (total_passed / total_tests) * 100
         print(f"Success rate: {success_rate:.1f}%")
+    print(f"Wall time: {elapsed:.1f}s")
 
     if total_passed < total_tests:
         print("\n💡 Tips:")
@@ -233,58 +399,47 @@ def print_summary(total_passed: int, total_tests: int) -> None:
         print("- Some models may have usage limits or require special access")
 
 
-def run_decorator_tests(
-    provider: Optional[str],
-    models: Optional[List[str]],
-    api_keys: Dict[str, str],
-    verbose: bool,
-    local: bool = False,
-    base_url: Optional[str] = None,
-) -> Tuple[int, int]:
-    total_passed = 0
-    total_tests = 0
-
-    if provider:
-        provider_models = get_models_by_provider(provider)
-        api_key_name = f"{provider.upper()}_API_KEY"
-        api_key = api_keys.get(api_key_name)
-        if not api_key:
-            print(
-                f"⚠️  Warning: No API key found for {provider}. Set {api_key_name} environment variable."
+def write_json_report(results: List[Dict[str, Any]], elapsed: float, path: str) -> None:
+    passed, total = count_passed(results)
+    report = {
+        "passed": passed,
+        "total": total,
+        "elapsed": elapsed,
+        "results": [
+            {key: value for key, value in result.items() if key != "response"}
+            for result in results
+        ],
+    }
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+
+def write_junit_report(
+    results: List[Dict[str, Any]], elapsed: float, path: str
+) -> None:
+    suite = ET.Element(
+        "testsuite",
+        name="chat",
+        tests=str(len(results)),
+        failures=str(sum(not result["passed"] for result in results)),
+        time=f"{elapsed:.3f}",
+    )
+    for result in results:
+        case = ET.SubElement(
+            suite,
+            "testcase",
+            classname=f"{result['provider']}.{result['model']}",
+            name=result["mode"],
+            time=f"{result['latency'] or 0:.3f}",
+        )
+        if result["ttft"] is not None:
+            properties = ET.SubElement(case, "properties")
+            ET.SubElement(
+                properties, "property", name="ttft", value=f"{result['ttft']:.3f}"
             )
-
-        for model in provider_models:
-            try:
-                if test_decorator(model, provider=provider, verbose=verbose):
-                    total_passed += 1
-                total_tests += 1
-                time.sleep(1)
-            except Exception as e:
-                print(f"❌ Failed to test decorator for {provider} {model}: {str(e)}")
-                total_tests += 1
-
-    elif models:
-        for model in models:
-            try:
-                if local:
-                    success = test_decorator(
-                        model,
-                        provider="openai",
-                        base_url=base_url,
-                        verbose=verbose,
-                    )
-                else:
-                    success = test_decorator(model, verbose=verbose)
-
-                if success:
-                    total_passed += 1
-                total_tests += 1
-                time.sleep(1)
-            except Exception as e:
-                print(f"❌ Failed to test decorator for {model}: {str(e)}")
-                total_tests += 1
-
-    return total_passed, total_tests
+        if not result["passed"]:
+            ET.SubElement(case, "failure", message=result["error"] or "empty response")
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
 
 
 def main():
@@ -302,6 +457,11 @@ Examples:
   python test.py --local --base-url http://localhost:1234/v1 --model hermes-3-llama-3.2-3b  # Test local models (requires local API)
   python test.py --decorators-only --provider openai    # Test only decorators for OpenAI
   python test.py --decorators-only --model sonnet3.5    # Test only decorators for specific model
+  python test.py --all --record cassettes/all.json      # Record real traffic into a cassette
+  python test.py --all --replay cassettes/all.json      # Replay it offline, instantly
+  python test.py --all --replay cassettes/all.json --realtime  # Replay at the recorded pace
+  python test.py --all --decorators --offline           # Run everything against a local stand-in
+  python test.py --all --report report.json --junit report.xml  # Write reports for CI
         """,
     )
 
@@ -332,6 +492,37 @@ Examples:
         default="Provide accurate and concise responses.",
         help="System prompt to use",
     )
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument(
+        "--record", metavar="PATH", help="Record provider traffic into a cassette"
+    )
+    cassette_group.add_argument(
+        "--replay", metavar="PATH", help="Replay a cassette instead of the network"
+    )
+    cassette_group.add_argument(
+        "--offline",
+        action="store_true",
+        help="Send every model to a local OpenAI-compatible stand-in",
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="Replay cassettes with their original latency and chunk timings",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=DEFAULT_RATE_LIMIT,
+        help=f"Requests per second per provider (default: {DEFAULT_RATE_LIMIT})",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Models tested at once per provider (default: {DEFAULT_CONCURRENCY})",
+    )
+    parser.add_argument("--report", metavar="PATH", help="Write a JSON report")
+    parser.add_argument("--junit", metavar="PATH", help="Write a JUnit XML report")
 
     args = parser.parse_args()
 
@@ -363,64 +554,81 @@ Examples:
             "--decorators-only requires --provider or --model to specify which models to test"
         )
 
+    if args.rate_limit <= 0 or args.concurrency < 1:
+        parser.error("--rate-limit and --concurrency must be positive")
+
     api_keys = get_api_keys()
 
+    cassette = None
+    if args.record:
+        cassette = Cassette(args.record, mode="record")
+    elif args.replay:
+        cassette = Cassette(args.replay, mode="replay", realtime=args.realtime)
+
+    warn = not (args.replay or args.offline)
+    if args.all:
+        jobs = [
+            job
+            for provider in ["openai", "anthropic", "google"]
+            for job in provider_jobs(provider, api_keys, warn)
+        ]
+    elif args.provider:
+        jobs = provider_jobs(args.provider, api_keys, warn)
+    elif args.local:
+        jobs = local_jobs(args.model, args.base_url)
+    else:
+        jobs = specific_jobs(args.model)
+
+    # Keep each job's group, so the stand-in still sees per-provider pacing
+    base_url = None
+    if args.offline:
+        base_url = start_stand_in()
+        jobs = [
+            job._replace(provider="openai", base_url=base_url, api_key="offline")
+            for job in jobs
+        ]
+
+    if args.decorators_only:
+        modes = DECORATOR_MODES
+    elif args.decorators:
+        modes = CHAT_MODES + DECORATOR_MODES
+    else:
+        modes = CHAT_MODES
+
     print("🚀 Starting AI model tests...")
     if args.verbose:
         print(f"System prompt: {args.system}")
-        print(f"Test decorators: {args.decorators or args.decorators_only}")
-        if args.decorators_only:
-            print("Mode: Decorators only")
-
-    total_passed = 0
-    total_tests = 0
+        print(f"Modes: {', '.join(modes)}")
+        print(f"Rate limit: {args.rate_limit}/s per provider")
 
+    started = time.monotonic()
     try:
-        if args.decorators_only:
-            total_passed, total_tests = run_decorator_tests(
-                args.provider,
-                args.model,
-                api_keys,
-                args.verbose,
-                args.local,
-                args.base_url,
-            )
-        elif args.all:
-            for provider in ["openai", "anthropic", "google"]:
-                passed, total = test_provider_models(
-                    provider, args.system, api_keys, args.decorators, args.verbose
-                )
-                total_passed += passed
-                total_tests += total
-        elif args.provider:
-            passed, total = test_provider_models(
-                args.provider, args.system, api_keys, args.decorators, args.verbose
-            )
-            total_passed += passed
-            total_tests += total
-        elif args.local:
-            passed, total = test_local_models(
-                args.base_url, args.model, args.system, args.decorators, args.verbose
-            )
-            total_passed += passed
-            total_tests += total
-        elif args.model:
-            passed, total = test_specific_models(
-                args.model,
-                args.system,
-                args.local,
-                args.base_url,
-                args.decorators,
-                args.verbose,
+        results = run_tests(
+            jobs,
+            modes,
+            args.system,
+            args.rate_limit,
+            args.concurrency,
+            cassette,
+            args.verbose,
+        )
+        if base_url and any(mode in DECORATOR_MODES for mode in modes):
+            result = test_coalescing(base_url)
+            print(
+                f"\n{'=' * 50}\nTesting {result['model']}\n{'=' * 50}\n"
+                + format_result(result, args.verbose)
             )
-            total_passed += passed
-            total_tests += total
-
+            results.append(result)
     except KeyboardInterrupt:
         print("\n\n⚠️  Tests interrupted by user")
         sys.exit(1)
+    elapsed = time.monotonic() - started
 
-    print_summary(total_passed, total_tests)
+    print_summary(results, elapsed)
+    if args.report:
+        write_json_report(results, elapsed, args.report)
+    if args.junit:
+        write_junit_report(results, elapsed, args.junit)
 
 
 if __name__ == "__main__":